@@ -16,6 +16,27 @@ DEFAULT_ARGS = {
     'page_titles': ['all'],
     'page_titles_match': [],
     'download_image': False,
+    'fetch_concurrency': 8,
+    'http_pool_size': 10,
+    'http_timeout': 60,
+    'http2': False,
+    'rate_limit': 3.0,
+    'max_retries': 5,
+    'max_retry_after': 60,
+    'no_cache': False,
+    'cache_max_mb': 256,
+    'incremental': False,
+    'full_index': False,
+    'index_full_scan_days': 7,
+    'database_row_limit': 0,
+    'jobs': 1,
+    'download_concurrency': 8,
+    'download_assets': False,
+    'download_max_mb': 0,
+    'optimize_images': False,
+    'image_widths': [640, 1280],
+    'image_format': 'webp',
+    'image_quality': 80,
 }
 SYS_ENV_MAP = {
     'blog_url': "NOTION_TOKEN_BLOG_URL",
@@ -135,7 +156,9 @@ class ArgsParser:
         import argparse
         parser = argparse.ArgumentParser(description='Process running args.')
         for key in DEFAULT_ARGS.keys():
-            parser.add_argument("--{}".format(key), nargs='?', default=None)
+            # bool args can be given as a bare flag, e.g. '--no_cache'
+            const = 'true' if type(DEFAULT_ARGS[key]) is bool else None
+            parser.add_argument("--{}".format(key), nargs='?', default=None, const=const)
 
         if Utils.is_unittest():
             # don NOT parse args when running from unittest
@@ -154,6 +177,8 @@ class ArgsParser:
                     Config.set(key, True if str(input_value).lower() == 'true' else False)
                 elif type(DEFAULT_ARGS[key]) is int:
                     Config.set(key, int(input_value))
+                elif type(DEFAULT_ARGS[key]) is float:
+                    Config.set(key, float(input_value))
                 elif type(DEFAULT_ARGS[key]) is list:
                     # list arg divided by '|'
                     Config.set(key, [it.strip() for it in str(input_value).split("|")])
@@ -21,8 +21,7 @@ def start():
     ]
     
     source_pages = []
-    for title in target_titles:
-        page = NotionReader.read_page_with_title(title)
+    for title, page in NotionReader.read_pages_with_titles(target_titles).items():
         if page:
              source_pages.append(page)
         else:
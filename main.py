@@ -1,4 +1,7 @@
 from config import Config
+from notion_assets import DownloadManager
+from notion_manifest import NotionManifest
+from notion_pipeline import PipelineStage
 from notion_reader import NotionReader
 from notion_writer import NotionWriter
 
@@ -6,10 +9,61 @@ from notion_writer import NotionWriter
 def start():
     print("Run with configs:")
     print("config = {}".format(Config.to_string()))
+    if Config.incremental():
+        start_incremental()
+        return
+
     NotionWriter.clean_output()
-    notion_pages = NotionReader.handle_post()
-    for notion_page in notion_pages:
-        NotionWriter.handle_page(notion_page)
+    manifest = NotionManifest(NotionManifest.get_manifest_path())
+    export_pages(NotionReader.iter_posts(), manifest)
+    manifest.save()
+
+
+def start_incremental():
+    # Only export pages edited since the last run, see NotionManifest
+    manifest = NotionManifest.load()
+    if manifest.is_reset:
+        # The outputs of the old configs are unknown to the new manifest, start over
+        NotionWriter.clean_output()
+    page_blocks = NotionReader.read_all_pages()
+
+    for page_id in manifest.get_removed_ids(page_blocks):
+        print("Page removed: {}".format(page_id))
+        manifest.remove(page_id)
+
+    changed_pages = [it for it in page_blocks if manifest.is_changed(it)]
+    print("Incremental export: {} of {} pages changed".format(len(changed_pages), len(page_blocks)))
+    export_pages(NotionReader.iter_posts(changed_pages), manifest)
+    manifest.save()
+
+
+def export_pages(notion_pages, manifest: NotionManifest):
+    """
+    Streaming pipeline: parse (NotionReader.iter_posts) -> write -> download images.
+    Stages are connected by bounded queues, so pages are written while the next ones
+    are still being fetched, and only a few of them are held in memory at a time.
+    """
+    # Outputs linking image variants, which are still being encoded when the page is written
+    variant_outputs = []
+
+    def write_page(notion_page):
+        manifest.delete_outputs(notion_page.id)
+        file_outputs = NotionWriter.handle_page(notion_page, download_manager)
+        manifest.put(notion_page.id, notion_page.last_edited_time, NotionManifest.get_output_paths(file_outputs))
+        variant_outputs.extend([it for it in file_outputs.values() if getattr(it, 'variant_sources', None)])
+
+    with DownloadManager() as download_manager, \
+            PipelineStage("write", write_page) as write_stage:
+        try:
+            for notion_page in notion_pages:
+                write_stage.put(notion_page)
+        finally:
+            # Stop parsing ahead if writing failed
+            if hasattr(notion_pages, 'close'):
+                notion_pages.close()
+
+    for output in variant_outputs:
+        NotionWriter.drop_failed_variants(output, download_manager)
 
 
 # Cli cmd example:
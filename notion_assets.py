@@ -0,0 +1,565 @@
+import atexit
+import calendar
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import typing
+import urllib.parse
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+from notion_cache import NotionApiCache
+from notion_transport import NotionTransport, RETRY_STATUS_CODES
+from utils.image_utils import ImageUtils
+from utils.utils import FileUtils, Utils
+
+DOWNLOAD_MANAGER = None
+DOWNLOAD_MANAGER_LOCK = threading.Lock()
+ASSET_STORE = None
+ASSET_STORE_LOCK = threading.Lock()
+# Whether Pillow is installed for optimize_images, checked once
+IMAGE_OPTIMIZER_SUPPORTED = None
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = (5, 30)
+
+# Signed urls closer than this to their expiry are refreshed before downloading
+EXPIRY_MARGIN_SECONDS = 60
+# Status codes of expired signed urls
+EXPIRED_STATUS_CODES = [400, 401, 403]
+
+
+class DownloadTooLargeError(IOError):
+    pass
+
+
+class DownloadManager:
+    """
+    Download files on a bounded pool of workers sharing one keep-alive session.
+
+    Bodies are streamed in chunks to a temp file next to the target, which is renamed
+    into place once complete, so a failed download never leaves a partial or error file
+    behind. Callers get the final path immediately and go on while the download runs.
+
+    Queued downloads run soonest-expiring first, see SignedUrl. The queue is bounded (workers * 4),
+    so this orders the downloads waiting at a time, not all of a run. Assets whose signed url
+    expired anyway are refreshed from their owning block and retried.
+    """
+
+    def __init__(self, workers: typing.Optional[int] = None):
+        self.workers = max(1, int(workers or Config.download_concurrency()))
+        self.session = DownloadManager.create_session(self.workers)
+        # (expiry, sequence, fn, args), urls without expiry go last in submission order
+        self.tasks = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.threads = [
+            threading.Thread(target=self._run_tasks, name="download-{}".format(it), daemon=True)
+            for it in range(self.workers)
+        ]
+        # Bound the queued downloads, submit() blocks when the workers fall behind
+        self.slots = threading.BoundedSemaphore(self.workers * 4)
+        self.futures: typing.Dict[str, Future] = {}
+        # (block id, version) -> blob path in the AssetStore, None if failed
+        self.asset_futures: typing.Dict[typing.Tuple[str, str], Future] = {}
+        self.lock = threading.Lock()
+        self.image_optimizer: typing.Optional[ImageOptimizer] = None
+        # variant file path -> True if encoded and linked
+        self.variant_futures: typing.Dict[str, Future] = {}
+        # Started last, the workers never see a half-built manager
+        for thread in self.threads:
+            thread.start()
+
+    @staticmethod
+    def get_instance() -> 'DownloadManager':
+        """
+        :return: the manager shared by downloads outside of a pipeline, e.g. NotionWriter.handle_page.
+        """
+        global DOWNLOAD_MANAGER
+        if not DOWNLOAD_MANAGER:
+            with DOWNLOAD_MANAGER_LOCK:
+                if not DOWNLOAD_MANAGER:
+                    DOWNLOAD_MANAGER = DownloadManager()
+                    # Nothing closes the shared manager, the AssetStore index is saved on exit
+                    atexit.register(DOWNLOAD_MANAGER.close)
+        return DOWNLOAD_MANAGER
+
+    @staticmethod
+    def create_session(pool_size: int) -> requests.Session:
+        retry = Retry(
+            total=int(Config.max_retries()),
+            backoff_factor=1.0,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=["GET"],
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def submit(self, url: str, file_path: str) -> Future:
+        """
+        Schedule the download of url to file_path, once per file_path.
+        """
+        with self.lock:
+            if file_path in self.futures:
+                return self.futures[file_path]
+            future = Future()
+            self.futures[file_path] = future
+        self._schedule(self._download_file, future, url, file_path)
+        return future
+
+    def submit_asset(self, block_id: str, version: str, url: str, file_path: str,
+                     expiry_time: typing.Optional[str] = None, property_name: typing.Optional[str] = None,
+                     variants: typing.Optional[typing.Dict[int, str]] = None) -> Future:
+        """
+        Schedule the asset of the block into file_path, through the AssetStore.
+        Assets already in the store are linked right away without any network request,
+        others are downloaded once however many files reference them.
+
+        :param expiry_time: 'expiry_time' of the Notion file object, read from the url if None.
+        :param property_name: the file is a property of the page block_id, e.g. 'cover', instead of a block.
+        :param variants: max width -> file path of the responsive variants to encode, see ImageOptimizer.
+        """
+        store = AssetStore.get_instance()
+        key = (block_id, version)
+        with self.lock:
+            if file_path in self.futures:
+                return self.futures[file_path]
+            future = Future()
+            self.futures[file_path] = future
+            blob_future = self.asset_futures.get(key)
+            is_new = blob_future is None
+            if is_new:
+                blob_future = Future()
+                self.asset_futures[key] = blob_future
+
+        if is_new:
+            blob_path = store.lookup(block_id, version)
+            if blob_path:
+                blob_future.set_result(blob_path)
+            else:
+                ext = os.path.splitext(file_path)[1]
+                expiry = SignedUrl.get_expiry(url, expiry_time)
+                self._schedule_at(
+                    expiry, self._download_asset, blob_future, store, block_id, version, url, expiry, ext, property_name)
+
+        variant_futures = self._register_variants(variants)
+
+        def on_blob(done: Future):
+            try:
+                future.set_result(bool(done.result()) and store.link(done.result(), file_path))
+            except Exception as e:
+                print("Link asset failed: {}\n{}".format(file_path, e))
+                future.set_result(False)
+            if variant_futures:
+                self._optimize(done.result() if future.result() else None, variant_futures)
+        blob_future.add_done_callback(on_blob)
+        return future
+
+    def _register_variants(
+            self, variants: typing.Optional[typing.Dict[int, str]]) -> typing.Dict[int, typing.Tuple[str, Future]]:
+        """
+        :return: max width -> (file path, future) of the variants not submitted yet.
+        """
+        variant_futures = {}
+        with self.lock:
+            for width, variant_path in (variants or {}).items():
+                if variant_path not in self.variant_futures:
+                    self.variant_futures[variant_path] = Future()
+                    variant_futures[width] = (variant_path, self.variant_futures[variant_path])
+        return variant_futures
+
+    def get_variant_future(self, variant_path: str) -> typing.Optional[Future]:
+        """
+        :return: future of whether the variant was encoded and linked to variant_path, see submit_asset.
+        """
+        with self.lock:
+            return self.variant_futures.get(variant_path)
+
+    def _optimize(self, blob_path: typing.Optional[str], variant_futures: typing.Dict[int, typing.Tuple[str, Future]]):
+        if not blob_path:
+            for _, future in variant_futures.values():
+                future.set_result(False)
+            return
+
+        with self.lock:
+            if not self.image_optimizer:
+                self.image_optimizer = ImageOptimizer(AssetStore.get_instance())
+            optimizer = self.image_optimizer
+
+        def on_variants(done: Future):
+            try:
+                variant_blobs = done.result()
+            except Exception as e:
+                print("Optimize image failed: {}\n{}".format(blob_path, e))
+                variant_blobs = {}
+            for width, (variant_path, future) in variant_futures.items():
+                if not variant_blobs.get(width):
+                    # Skipped, the original does not stand in under a variant name
+                    future.set_result(False)
+                    continue
+                try:
+                    future.set_result(AssetStore.link(variant_blobs.get(width), variant_path))
+                except Exception as e:
+                    print("Link asset failed: {}\n{}".format(variant_path, e))
+                    future.set_result(False)
+        optimizer.submit(blob_path, list(variant_futures.keys())).add_done_callback(on_variants)
+
+    def _download_file(self, future: Future, url: str, file_path: str):
+        try:
+            future.set_result(self.download(url, file_path))
+        except Exception as e:
+            print("Download failed: {}\n{}".format(url, e))
+            future.set_result(False)
+
+    def _download_asset(self, blob_future: Future, store: 'AssetStore',
+                        block_id: str, version: str, url: str, expiry: typing.Optional[float], ext: str,
+                        property_name: typing.Optional[str] = None):
+        temp_path = None
+        blob_path = None
+        try:
+            temp_path = store.new_temp_path()
+            if expiry and expiry - time.time() < EXPIRY_MARGIN_SECONDS:
+                url = SignedUrl.refresh(block_id, property_name) or url
+            try:
+                downloaded = self.download(url, temp_path, raise_expired=True)
+            except requests.exceptions.HTTPError as e:
+                # Expired while queued, download again with a fresh url
+                print("Signed url expired, refresh block {}: {}".format(block_id, e))
+                fresh_url = SignedUrl.refresh(block_id, property_name)
+                downloaded = bool(fresh_url) and self.download(fresh_url, temp_path)
+            if downloaded:
+                blob_path = store.put_file(block_id, version, temp_path, ext)
+        except Exception as e:
+            print("Store asset failed: {}\n{}".format(url, e))
+        finally:
+            # put_file() moved it into the store, otherwise never leave it behind
+            if temp_path and FileUtils.exists(temp_path):
+                os.remove(temp_path)
+            blob_future.set_result(blob_path)
+
+    def _schedule(self, fn, *args):
+        self._schedule_at(None, fn, *args)
+
+    def _schedule_at(self, expiry: typing.Optional[float], fn, *args):
+        # Blocks while too many downloads are queued, so the expiry order only holds among
+        # the queued ones. Pages stream in while others download, later ones are not known yet
+        self.slots.acquire()
+        self.tasks.put((expiry or math.inf, next(self.sequence), fn, args))
+
+    def _run_tasks(self):
+        while True:
+            _, _, fn, args = self.tasks.get()
+            if fn is None:
+                return
+            try:
+                fn(*args)
+            except Exception as e:
+                print("Download task failed: {}".format(e))
+            finally:
+                self.slots.release()
+
+    def download(self, url: str, file_path: str, raise_expired: bool = False) -> bool:
+        """
+        Download url to file_path in the calling thread.
+
+        :param raise_expired: raise the HTTPError of expired signed urls instead of reporting it.
+        :return: True if downloaded, failures are reported and skipped.
+        """
+        FileUtils.create_dir(os.path.dirname(file_path) or '.')
+        fd, temp_path = tempfile.mkstemp(prefix=".download-", suffix=".part", dir=os.path.dirname(file_path) or '.')
+        max_bytes = float(Config.download_max_mb() or 0) * 1024 * 1024
+        try:
+            with os.fdopen(fd, 'wb') as f, self.session.get(
+                    url, allow_redirects=True, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                if max_bytes and int(r.headers.get('Content-Length') or 0) > max_bytes:
+                    raise DownloadTooLargeError("Content-Length {} over download_max_mb".format(
+                        r.headers.get('Content-Length')))
+                size = 0
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        size += len(chunk)
+                        if max_bytes and size > max_bytes:
+                            raise DownloadTooLargeError("Body over download_max_mb")
+                        f.write(chunk)
+            os.replace(temp_path, file_path)
+            return True
+        except (requests.exceptions.RequestException, OSError) as e:
+            if FileUtils.exists(temp_path):
+                os.remove(temp_path)
+            if raise_expired and isinstance(e, requests.exceptions.HTTPError) \
+                    and e.response is not None and e.response.status_code in EXPIRED_STATUS_CODES:
+                raise e
+            print("Download failed: {}\n{}".format(url, e))
+            return False
+
+    def wait(self) -> int:
+        """
+        Wait for the scheduled downloads.
+
+        :return: the number of failed downloads.
+        """
+        with self.lock:
+            futures = list(self.futures.values())
+        failed = len([it for it in futures if not it.result()])
+        # Variants not encoded are skipped rather than failed
+        with self.lock:
+            variant_futures = list(self.variant_futures.values())
+        for future in variant_futures:
+            future.result()
+        return failed
+
+    def close(self):
+        failed = self.wait()
+        if failed > 0:
+            print("{} of {} downloads failed".format(failed, len(self.futures)))
+        for _ in self.threads:
+            self.tasks.put((math.inf, next(self.sequence), None, None))
+        for thread in self.threads:
+            thread.join()
+        self.session.close()
+        if self.image_optimizer:
+            self.image_optimizer.close()
+        if self.asset_futures:
+            AssetStore.get_instance().save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ImageOptimizer:
+    """
+    Encode width-bounded, recompressed variants of downloaded images on a process pool.
+
+    Variants live in the AssetStore next to the blobs, named by the content hash of the
+    original and the encoding options, so unchanged images are never encoded again.
+    """
+
+    def __init__(self, store: 'AssetStore', workers: typing.Optional[int] = None):
+        self.store = store
+        # Spawned, forking a process with running download threads is not safe
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.image_format = str(Config.image_format()).lower()
+        self.quality = int(Config.image_quality())
+        # blob path -> future of its variants, each image is encoded once per run
+        self.futures: typing.Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_enabled() -> bool:
+        global IMAGE_OPTIMIZER_SUPPORTED
+        if not Config.optimize_images():
+            return False
+        if IMAGE_OPTIMIZER_SUPPORTED is None:
+            IMAGE_OPTIMIZER_SUPPORTED = ImageUtils.is_supported()
+            if not IMAGE_OPTIMIZER_SUPPORTED:
+                print("Pillow not installed, skip optimize_images, pls exec 'pip install Pillow' first!")
+        return IMAGE_OPTIMIZER_SUPPORTED
+
+    @staticmethod
+    def get_widths() -> typing.List[int]:
+        return sorted(set([int(it) for it in Config.image_widths()]))
+
+    def get_variant_path(self, blob_path: str, width: int) -> str:
+        content_hash = os.path.splitext(os.path.basename(blob_path))[0]
+        return os.path.join(
+            self.store.store_dir, "variants", content_hash[:2],
+            "{}_{}w_q{}{}".format(content_hash, width, self.quality, ImageUtils.get_variant_ext(self.image_format)))
+
+    def submit(self, blob_path: str, widths: typing.List[int]) -> Future:
+        """
+        :return: future of max width -> variant blob path, missing for the widths that could not be encoded.
+        """
+        with self.lock:
+            if blob_path in self.futures:
+                return self.futures[blob_path]
+            future = Future()
+            self.futures[blob_path] = future
+
+        variants = {it: self.get_variant_path(blob_path, it) for it in widths}
+        missing = [(width, path) for width, path in variants.items() if not FileUtils.exists(path)]
+        if not missing or not ImageUtils.can_optimize(blob_path):
+            future.set_result({width: path for width, path in variants.items() if FileUtils.exists(path)})
+            return future
+
+        def on_encoded(done: Future):
+            try:
+                done.result()
+            except Exception as e:
+                print("Optimize image failed: {}\n{}".format(blob_path, e))
+            future.set_result({width: path for width, path in variants.items() if FileUtils.exists(path)})
+        self.executor.submit(
+            ImageUtils.encode_variants, blob_path, missing, self.image_format, self.quality
+        ).add_done_callback(on_encoded)
+        return future
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class SignedUrl:
+    """
+    Notion hosted files come as signed S3 urls, expiring about an hour after the block was fetched.
+    """
+
+    @staticmethod
+    def get_expiry(url: str, expiry_time: typing.Optional[str] = None) -> typing.Optional[float]:
+        """
+        :return: the expiry as a unix timestamp, from the 'expiry_time' of the file object
+                 or the 'X-Amz-Date' and 'X-Amz-Expires' of the url. None if not signed.
+        """
+        try:
+            if expiry_time:
+                return datetime.fromisoformat(expiry_time.replace('Z', '+00:00')).timestamp()
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            if 'X-Amz-Date' in params and 'X-Amz-Expires' in params:
+                signed_at = calendar.timegm(time.strptime(params['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ'))
+                return signed_at + int(params['X-Amz-Expires'][0])
+        except (ValueError, TypeError) as e:
+            print("Cannot read expiry of {}: {}".format(url, e))
+        return None
+
+    @staticmethod
+    def refresh(block_id: str, property_name: typing.Optional[str] = None) -> typing.Optional[str]:
+        """
+        Re-fetch the block owning the file for a freshly signed url.
+
+        :param property_name: read the file from this property of the page block_id, e.g. 'cover'.
+        """
+        try:
+            client = NotionTransport.get_client()
+            if property_name:
+                file_object = client.pages.retrieve(page_id=block_id).get(property_name) or {}
+            else:
+                block = client.blocks.retrieve(block_id=block_id)
+                file_object = block.get(block.get('type'), {})
+            if file_object.get('type') == 'file':
+                return file_object.get('file', {}).get('url')
+            print("Block {} has no Notion hosted file".format(block_id))
+        except Exception as e:
+            print("Refresh signed url of block {} failed: {}".format(block_id, e))
+        return None
+
+
+class AssetStore:
+    """
+    Content-addressed store of downloaded assets, persisted under the workspace cache.
+
+    Blobs are named by the SHA-256 of their content, and an index maps the Notion block id,
+    with the version of its file, to the blob. Channel 'assets' dirs get hardlinks (or copies
+    across devices) of the blobs, so an image reused by many pages, channels and runs is
+    downloaded and stored once, and images with the same name no longer collide.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, "index.json")
+        # block id -> {"version", "hash", "ext"}
+        self.index: typing.Dict[str, typing.Dict[str, str]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> 'AssetStore':
+        global ASSET_STORE
+        if not ASSET_STORE:
+            with ASSET_STORE_LOCK:
+                if not ASSET_STORE:
+                    store = AssetStore(os.path.join(NotionApiCache.get_cache_dir(), "assets"))
+                    if not Config.no_cache():
+                        store.load()
+                    ASSET_STORE = store
+        return ASSET_STORE
+
+    def load(self):
+        if not FileUtils.exists(self.index_path):
+            return
+        try:
+            self.index = Utils.parse_json(self.index_path).get('blocks', {})
+        except Exception as e:
+            print("Ignore broken asset index {}: {}".format(self.index_path, e))
+            self.index = {}
+
+    def save(self):
+        with self.lock:
+            FileUtils.create_file(self.index_path)
+            FileUtils.write_text(json.dumps({"blocks": self.index}, ensure_ascii=False), self.index_path)
+
+    def lookup(self, block_id: str, version: str) -> typing.Optional[str]:
+        """
+        :return: the blob of the block's asset at this version, None if not stored.
+        """
+        with self.lock:
+            record = self.index.get(block_id)
+        if not record or record.get('version') != version:
+            return None
+        blob_path = self.get_blob_path(record.get('hash'), record.get('ext'))
+        return blob_path if FileUtils.exists(blob_path) else None
+
+    def new_temp_path(self) -> str:
+        temp_dir = os.path.join(self.store_dir, "tmp")
+        FileUtils.create_dir(temp_dir)
+        fd, temp_path = tempfile.mkstemp(prefix=".asset-", dir=temp_dir)
+        os.close(fd)
+        return temp_path
+
+    def put_file(self, block_id: str, version: str, temp_path: str, ext: str = '') -> str:
+        """
+        Move a downloaded file into the store and index it for the block.
+
+        :return: the blob path.
+        """
+        digest = hashlib.sha256()
+        with open(temp_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+
+        blob_path = self.get_blob_path(content_hash, ext)
+        FileUtils.create_dir(os.path.dirname(blob_path))
+        if FileUtils.exists(blob_path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, blob_path)
+        with self.lock:
+            self.index[block_id] = {"version": version, "hash": content_hash, "ext": ext}
+        return blob_path
+
+    def get_blob_path(self, content_hash: str, ext: str = '') -> str:
+        return os.path.join(self.store_dir, "blobs", content_hash[:2], content_hash + (ext or ''))
+
+    @staticmethod
+    def link(blob_path: str, file_path: str) -> bool:
+        """
+        Place the blob at file_path, as a hardlink or a copy if linking is not possible.
+        """
+        if FileUtils.exists(file_path) and os.path.samefile(blob_path, file_path):
+            return True
+        file_dir = os.path.dirname(file_path) or '.'
+        FileUtils.create_dir(file_dir)
+        fd, temp_path = tempfile.mkstemp(prefix=".link-", suffix=".part", dir=file_dir)
+        os.close(fd)
+        os.remove(temp_path)
+        try:
+            os.link(blob_path, temp_path)
+        except OSError:
+            shutil.copyfile(blob_path, temp_path)
+        os.replace(temp_path, file_path)
+        return True
@@ -0,0 +1,218 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+from datetime import datetime
+
+from config import Config
+from utils.utils import FileUtils
+
+API_CACHE = None
+API_CACHE_LOCK = threading.Lock()
+# Entries holding a signed url that expires within this many seconds are reloaded
+SIGNED_URL_MARGIN = 300
+
+
+class NotionApiCache:
+    """
+    Persistent cache of Notion API responses, stored as SQLite under the workspace.
+
+    Every entry is stored with a version, usually the 'last_edited_time' of the object
+    it was fetched for, and is only reused while that version still matches.
+    Entries are evicted in LRU order once the cache grows over its size budget.
+    Responses embed the signed urls of Notion hosted files, an entry is reloaded
+    once the earliest of them is about to expire.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int):
+        FileUtils.create_dir(os.path.dirname(db_path))
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                version TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def get_instance() -> typing.Optional['NotionApiCache']:
+        """
+        :return: the shared cache of this run, None when disabled by 'no_cache'.
+        """
+        global API_CACHE
+        if Config.no_cache():
+            return None
+        if not API_CACHE:
+            with API_CACHE_LOCK:
+                if not API_CACHE:
+                    API_CACHE = NotionApiCache(
+                        os.path.join(NotionApiCache.get_cache_dir(), "api_cache.sqlite"),
+                        int(Config.cache_max_mb()) * 1024 * 1024
+                    )
+        return API_CACHE
+
+    @staticmethod
+    def get_cache_dir() -> str:
+        return os.path.join(Config.workspace(), ".notion_cache")
+
+    @staticmethod
+    def cached(namespace: str, key: str, version: typing.Optional[str], loader: typing.Callable[[], typing.Any]):
+        """
+        Return the cached value of (namespace, key) if its version matches, otherwise load and cache it.
+        Nothing is cached without a version, or when the cache is disabled.
+        """
+        cache = NotionApiCache.get_instance()
+        if not cache or not version:
+            return loader()
+
+        value = cache.get(namespace, key, version)
+        if value is not None and not NotionApiCache.has_expired_urls(value):
+            return value
+        value = loader()
+        cache.put(namespace, key, version, value)
+        return value
+
+    @staticmethod
+    def has_expired_urls(value: typing.Any) -> bool:
+        """
+        :return: True if a signed url within the response expired, or is about to.
+        """
+        expiry = NotionApiCache.get_earliest_expiry(value)
+        return expiry is not None and expiry <= time.time() + SIGNED_URL_MARGIN
+
+    @staticmethod
+    def get_earliest_expiry(value: typing.Any) -> typing.Optional[float]:
+        """
+        :return: the earliest 'expiry_time' of the file objects within the response, None if there is none.
+        """
+        earliest = None
+        stack = [value]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict):
+                expiry_time = item.get('expiry_time')
+                if isinstance(expiry_time, str):
+                    try:
+                        expiry = datetime.fromisoformat(expiry_time.replace('Z', '+00:00')).timestamp()
+                    except ValueError:
+                        expiry = 0.0
+                    earliest = expiry if earliest is None else min(earliest, expiry)
+                stack.extend(item.values())
+            elif isinstance(item, list):
+                stack.extend(item)
+        return earliest
+
+    def get(self, namespace: str, key: str, version: str) -> typing.Optional[typing.Any]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT version, value FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if not row or row[0] != version:
+                return None
+            self.db.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (time.time(), namespace, key)
+            )
+            self.db.commit()
+        return json.loads(row[1])
+
+    def put(self, namespace: str, key: str, version: str, value: typing.Any):
+        text = json.dumps(value, ensure_ascii=False)
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, version, value, size, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, version, text, size, time.time())
+            )
+            self.total_bytes += size - (row[0] if row else 0)
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.db.execute(
+                "SELECT namespace, key, size FROM entries ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for namespace, key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM entries")
+            self.db.commit()
+            self.total_bytes = 0
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class RunMemo:
+    """
+    In-memory memo shared by all pages within a run, thread-safe.
+
+    Concurrent callers of the same key wait for a single load instead of loading it twice.
+    Failed loads are not memoized.
+    """
+
+    def __init__(self):
+        self.values: typing.Dict[typing.Any, typing.Any] = {}
+        self.key_locks: typing.Dict[typing.Any, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.values.get(key, default)
+
+    def get_or_load(self, key, loader: typing.Callable[[], typing.Any]):
+        with self.lock:
+            if key in self.values:
+                return self.values[key]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.values:
+                    return self.values[key]
+            value = loader()
+            with self.lock:
+                self.values[key] = value
+                self.key_locks.pop(key, None)
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.key_locks.clear()
+
+
+# Parsed subtrees of synced block sources, keyed by source block id, and their rendered
+# markdown, keyed by ('markdown', source block id). Shared by all pages within the run.
+SYNCED_BLOCK_MEMO = RunMemo()
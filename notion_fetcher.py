@@ -0,0 +1,103 @@
+import asyncio
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+
+from config import Config
+from notion_cache import NotionApiCache, SYNCED_BLOCK_MEMO
+from notion_transport import NotionTransport
+
+# Children of these blocks belong to another page or database, NotionPage never walks them.
+SKIP_CHILDREN_TYPES = [
+    'child_page',
+    'child_database',
+]
+
+
+class NotionBlockFetcher:
+    """
+    Prefetch the whole block tree of a page before parsing.
+
+    Blocks with 'has_children' are discovered level by level, and the children of
+    every block within the same level are listed concurrently, with at most
+    'concurrency' requests in flight.
+    """
+
+    def __init__(self, concurrency: typing.Optional[int] = None):
+        self.concurrency = max(1, int(concurrency or Config.fetch_concurrency() or 1))
+
+    def fetch_tree(self, root_id: str, last_edited_time: typing.Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        :return: block_id -> children blocks, for the root and every reachable block.
+                 Blocks whose listing failed are left out, so callers can fall back to list_children.
+        """
+        return asyncio.run(self._fetch_tree(root_id, last_edited_time))
+
+    async def _fetch_tree(self, root_id: str, last_edited_time: typing.Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+        loop = asyncio.get_running_loop()
+        children_map = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # (block_id, last_edited_time) of the blocks to list
+            level = [(root_id, last_edited_time)]
+            while level:
+                results = await asyncio.gather(
+                    *[loop.run_in_executor(executor, NotionBlockFetcher.list_children, *it) for it in level],
+                    return_exceptions=True
+                )
+                next_level = {}
+                for (block_id, _), children in zip(level, results):
+                    if isinstance(children, Exception):
+                        print("Prefetch children of {} failed: {}".format(block_id, children))
+                        continue
+                    children_map[block_id] = children
+                    for child in children:
+                        for fetch_id, version in NotionBlockFetcher._get_fetch_ids(child):
+                            next_level.setdefault(fetch_id, version)
+                level = [it for it in next_level.items() if it[0] not in children_map]
+        return children_map
+
+    @staticmethod
+    def _get_fetch_ids(block: Dict[str, Any]) -> List[typing.Tuple[str, typing.Optional[str]]]:
+        if block.get('type') in SKIP_CHILDREN_TYPES:
+            return []
+        if block.get('type') == 'synced_block':
+            # Reference copy of a source parsed earlier in this run
+            synced_from = block.get('synced_block', {}).get('synced_from')
+            if synced_from and SYNCED_BLOCK_MEMO.get(synced_from.get('block_id')) is not None:
+                return []
+        if block.get('has_children'):
+            return [(block.get('id'), block.get('last_edited_time'))]
+        if block.get('type') == 'synced_block':
+            # Reference copy without children, its content lives under the source block
+            synced_from = block.get('synced_block', {}).get('synced_from')
+            if synced_from and synced_from.get('block_id'):
+                return [(synced_from.get('block_id'), None)]
+        return []
+
+    @staticmethod
+    def list_children(block_id: str, last_edited_time: typing.Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        List all children of the block, reusing the cached listing while the
+        block's 'last_edited_time' is unchanged.
+        """
+        return NotionApiCache.cached(
+            'blocks.children',
+            block_id,
+            last_edited_time,
+            lambda: NotionBlockFetcher._list_children(block_id)
+        )
+
+    @staticmethod
+    def _list_children(block_id: str) -> List[Dict[str, Any]]:
+        children = []
+        has_more = True
+        start_cursor = None
+        while has_more:
+            response = NotionTransport.get_client().blocks.children.list(
+                block_id=block_id,
+                start_cursor=start_cursor
+            )
+            children.extend(response.get('results', []))
+            has_more = response.get('has_more')
+            start_cursor = response.get('next_cursor')
+        return children
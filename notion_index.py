@@ -0,0 +1,322 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import typing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple
+
+from config import Config
+from notion_cache import NotionApiCache
+from notion_transport import NotionTransport
+from utils.utils import FileUtils, Utils
+
+PAGE_INDEX = None
+PAGE_INDEX_LOCK = threading.Lock()
+
+PARENT_TYPES = ['page_id', 'database_id', 'block_id']
+
+# (parent type, parent id without dashes)
+ParentNode = Tuple[str, str]
+# retrieve_parent() failed for now, e.g. 429, 5xx or network errors. Never recorded, retried next time
+UNRESOLVED = ('unresolved', '')
+
+
+class NotionPageIndex:
+    """
+    Index of all pages in the workspace, persisted between runs.
+
+    The first run scans the whole workspace with the Search API. Later runs search
+    sorted by 'last_edited_time' descending and stop paging once the results get older
+    than the stored watermark, then merge the deltas into the index.
+    Pages deleted or un-shared never show up in a delta, so the index is rebuilt by a full scan
+    every 'index_full_scan_days' days, or with '--full_index'.
+    Indexed page objects keep the signed file urls (e.g. covers) of the search they came from,
+    NotionReader retrieves a page again before parsing once they expired.
+
+    It also keeps the page hierarchy: the parents of the non-page nodes (databases and blocks)
+    pages live under are resolved once and persisted, so subtree queries are a dictionary walk.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.watermark: typing.Optional[str] = None
+        # unix time of the last full scan
+        self.full_scan_at: float = 0
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        # node id -> parent node, for the databases and blocks between pages
+        self.nodes: Dict[str, typing.Optional[ParentNode]] = {}
+        self.children_map: typing.Optional[Dict[str, List[str]]] = None
+        self.refreshed = False
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def get_instance() -> 'NotionPageIndex':
+        global PAGE_INDEX
+        if not PAGE_INDEX:
+            with PAGE_INDEX_LOCK:
+                if not PAGE_INDEX:
+                    index = NotionPageIndex(NotionPageIndex.get_index_path())
+                    if not Config.no_cache():
+                        index.load()
+                    PAGE_INDEX = index
+        return PAGE_INDEX
+
+    @staticmethod
+    def get_index_path() -> str:
+        # One index per integration token, they may see different workspaces
+        token_hash = hashlib.sha1(str(Config.notion_token()).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(NotionApiCache.get_cache_dir(), "page_index_{}.json".format(token_hash))
+
+    def load(self):
+        if not FileUtils.exists(self.index_path):
+            return
+        try:
+            json_obj = Utils.parse_json(self.index_path)
+            self.watermark = json_obj.get('watermark')
+            self.full_scan_at = json_obj.get('full_scan_at') or 0
+            self.pages = json_obj.get('pages', {})
+            self.nodes = {k: tuple(v) if v else None for k, v in json_obj.get('nodes', {}).items()}
+        except Exception as e:
+            print("Ignore broken page index {}: {}".format(self.index_path, e))
+            self.watermark = None
+            self.full_scan_at = 0
+            self.pages = {}
+            self.nodes = {}
+
+    def save(self):
+        with self.lock:
+            FileUtils.create_file(self.index_path)
+            FileUtils.write_text(json.dumps({
+                "watermark": self.watermark,
+                "full_scan_at": self.full_scan_at,
+                "pages": self.pages,
+                "nodes": self.nodes,
+            }, ensure_ascii=False), self.index_path)
+
+    def get_pages(self) -> List[Dict[str, Any]]:
+        """
+        :return: all pages of the workspace, most recently edited first. Refreshed once per run.
+        """
+        with self.lock:
+            if not self.refreshed:
+                self.refresh()
+            return sorted(self.pages.values(), key=lambda it: it.get('last_edited_time') or '', reverse=True)
+
+    def refresh(self):
+        with self.lock:
+            full_scan = not self.watermark or not self.pages or self.need_full_scan()
+            print("Searching {} pages in workspace...".format("all" if full_scan else "updated"))
+            results = NotionPageIndex._search_pages(None if full_scan else self.watermark)
+
+            if full_scan:
+                # Replace wholesale, dropping the pages deleted or un-shared since
+                self.pages = {}
+                self.full_scan_at = time.time()
+                # Re-resolve the parents, blocks holding pages may have moved
+                self.nodes = {}
+            for page in results:
+                if page.get('archived') or page.get('in_trash'):
+                    self.pages.pop(page.get('id'), None)
+                    continue
+                self.pages[page.get('id')] = page
+
+            edited_times = [it.get('last_edited_time') for it in results if it.get('last_edited_time')]
+            if edited_times:
+                self.watermark = max(edited_times + ([self.watermark] if self.watermark else []))
+            print("Page index refreshed, {} updated, {} total".format(len(results), len(self.pages)))
+            self.refreshed = True
+            self.children_map = None
+            self.save()
+
+    def need_full_scan(self) -> bool:
+        if Config.full_index():
+            return True
+        max_age = float(Config.index_full_scan_days() or 0) * 24 * 3600
+        return max_age > 0 and time.time() - self.full_scan_at > max_age
+
+    def get_descendants(self, root_id: str, edited_since: typing.Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        :return: the root page (if indexed) and all pages under it in BFS order,
+                 only those edited at or after 'edited_since' if given.
+        """
+        with self.lock:
+            if not self.refreshed:
+                self.refresh()
+            if self.children_map is None:
+                self._resolve_nodes()
+                self.children_map = NotionPageIndex.build_children_map(self.get_pages(), self.nodes)
+            children_map = self.children_map
+        return NotionPageIndex.bfs_descendants(self.pages.values(), children_map, root_id, edited_since)
+
+    def resolve_parent(self, node: ParentNode) -> typing.Optional[ParentNode]:
+        """
+        :return: the parent of the node, from the index if known, otherwise retrieved and recorded.
+                 Thread-safe, e.g. for the concurrent title searches of NotionReader.
+        """
+        node_id = node[1]
+        with self.lock:
+            page = self._get_page(node_id)
+            if page:
+                return NotionPageIndex.get_parent(page)
+            if node_id in self.nodes:
+                return self.nodes[node_id]
+
+        # Retrieved outside of the lock, the other threads do not queue behind the request
+        parent = NotionPageIndex.retrieve_parent(node)
+        if parent == UNRESOLVED:
+            return None
+        with self.lock:
+            if node_id not in self.nodes:
+                self.nodes[node_id] = parent
+                self.children_map = None
+            return self.nodes[node_id]
+
+    def _get_page(self, node_id: str) -> typing.Optional[Dict[str, Any]]:
+        page = self.pages.get(node_id)
+        if not page and len(node_id) == 32:
+            page = self.pages.get('{}-{}-{}-{}-{}'.format(
+                node_id[:8], node_id[8:12], node_id[12:16], node_id[16:20], node_id[20:]))
+        return page
+
+    def _resolve_nodes(self):
+        """
+        Resolve the parent chains of all non-indexed parents, e.g. databases and blocks holding pages.
+        Runs under the index lock, failed lookups (UNRESOLVED) are left out and retried next time.
+        """
+        with self.lock:
+            page_ids = set([NotionPageIndex.normalize_id(it) for it in self.pages.keys()])
+            pending = set()
+            for page in self.pages.values():
+                parent = NotionPageIndex.get_parent(page)
+                if parent and parent[1] not in page_ids and parent[1] not in self.nodes:
+                    pending.add(parent)
+
+            resolved = 0
+            with ThreadPoolExecutor(max_workers=max(1, int(Config.fetch_concurrency()))) as executor:
+                while pending:
+                    nodes = list(pending)
+                    pending = set()
+                    for node, parent in zip(nodes, executor.map(NotionPageIndex.retrieve_parent, nodes)):
+                        if parent == UNRESOLVED:
+                            continue
+                        self.nodes[node[1]] = parent
+                        resolved += 1
+                        if parent and parent[1] not in page_ids and parent[1] not in self.nodes:
+                            pending.add(parent)
+            if resolved > 0:
+                print("Page index resolved {} parent nodes".format(resolved))
+                self.save()
+
+    @staticmethod
+    def build_children_map(
+            pages: typing.Iterable[Dict[str, Any]],
+            nodes: Dict[str, typing.Optional[ParentNode]]) -> Dict[str, List[str]]:
+        """
+        :return: parent id -> child ids (pages and nodes), ids without dashes.
+        """
+        children_map = {}
+        for page in pages:
+            parent = NotionPageIndex.get_parent(page)
+            if parent:
+                children_map.setdefault(parent[1], []).append(NotionPageIndex.normalize_id(page.get('id')))
+        for node_id, parent in nodes.items():
+            if parent:
+                children_map.setdefault(parent[1], []).append(node_id)
+        return children_map
+
+    @staticmethod
+    def bfs_descendants(
+            pages: typing.Iterable[Dict[str, Any]],
+            children_map: Dict[str, List[str]],
+            root_id: str,
+            edited_since: typing.Optional[str] = None) -> List[Dict[str, Any]]:
+        if not root_id:
+            return []
+        page_map = {NotionPageIndex.normalize_id(it.get('id')): it for it in pages}
+
+        descendants = []
+        queue = deque([NotionPageIndex.normalize_id(root_id)])
+        visited = set()
+        while queue:
+            current_id = queue.popleft()
+            if current_id in visited:
+                continue
+            visited.add(current_id)
+
+            page = page_map.get(current_id)
+            if page and (not edited_since or (page.get('last_edited_time') or '') >= edited_since):
+                descendants.append(page)
+            queue.extend(children_map.get(current_id, []))
+        return descendants
+
+    @staticmethod
+    def normalize_id(object_id: str) -> str:
+        return str(object_id).replace('-', '')
+
+    @staticmethod
+    def get_parent(notion_object: Dict[str, Any]) -> typing.Optional[ParentNode]:
+        """
+        :return: (parent type, parent id without dashes), None for workspace level objects.
+        """
+        parent = notion_object.get('parent') or {}
+        parent_type = parent.get('type')
+        if parent_type == 'data_source_id' and parent.get('database_id'):
+            parent_type = 'database_id'
+        if parent_type not in PARENT_TYPES:
+            return None
+        return parent_type, NotionPageIndex.normalize_id(parent.get(parent_type))
+
+    @staticmethod
+    def retrieve_parent(node: ParentNode) -> typing.Optional[ParentNode]:
+        """
+        :return: the parent, None for workspace level or no longer accessible nodes,
+                 UNRESOLVED if the lookup failed for now.
+        """
+        node_type, node_id = node
+        client = NotionTransport.get_client()
+        try:
+            if node_type == 'page_id':
+                return NotionPageIndex.get_parent(client.pages.retrieve(page_id=node_id))
+            if node_type == 'block_id':
+                return NotionPageIndex.get_parent(client.blocks.retrieve(block_id=node_id))
+            if node_type == 'database_id':
+                return NotionPageIndex.get_parent(client.databases.retrieve(database_id=node_id))
+        except Exception as e:
+            print("Cannot resolve parent of {}: {}".format(node_id, e))
+            if getattr(e, 'status', None) == 404 or getattr(e, 'code', None) == 'object_not_found':
+                return None
+            return UNRESOLVED
+        return None
+
+    @staticmethod
+    def _search_pages(watermark: typing.Optional[str]) -> List[Dict[str, Any]]:
+        """
+        Search pages edited at or after the watermark (all pages if None), most recently edited first.
+        """
+        pages = []
+        has_more = True
+        start_cursor = None
+        while has_more:
+            response = NotionTransport.get_client().search(
+                filter={"value": "page", "property": "object"},
+                sort={"direction": "descending", "timestamp": "last_edited_time"},
+                start_cursor=start_cursor,
+                page_size=100
+            )
+            results = response.get('results', [])
+            has_more = response.get('has_more')
+            start_cursor = response.get('next_cursor')
+
+            if watermark:
+                # last_edited_time is minute-rounded, keep the pages at the watermark itself
+                fresh_results = [it for it in results if (it.get('last_edited_time') or '') >= watermark]
+                pages.extend(fresh_results)
+                if len(fresh_results) < len(results):
+                    break
+            else:
+                pages.extend(results)
+            print(f"Fetched {len(results)} pages, total so far: {len(pages)}")
+        return pages
@@ -0,0 +1,112 @@
+import json
+import os
+import typing
+from typing import List, Dict, Any
+
+from config import Config
+from utils.utils import FileUtils, Utils
+
+MANIFEST_FILE_NAME = ".notiondown_manifest.json"
+
+
+class NotionManifest:
+    """
+    Record of the last export: page id -> last_edited_time -> output paths.
+
+    Incremental runs use it to only re-export pages whose 'last_edited_time' moved,
+    and to delete the outputs of pages that disappeared.
+    The manifest is reset when the output related configs change.
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.fingerprint = NotionManifest._get_fingerprint()
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        # The manifest of the last export was dropped, e.g. for changed output configs
+        self.is_reset = False
+
+    @staticmethod
+    def get_manifest_path() -> str:
+        return os.path.join(Config.output(), MANIFEST_FILE_NAME)
+
+    @staticmethod
+    def load() -> 'NotionManifest':
+        manifest = NotionManifest(NotionManifest.get_manifest_path())
+        if not FileUtils.exists(manifest.manifest_path):
+            return manifest
+        try:
+            json_obj = Utils.parse_json(manifest.manifest_path)
+        except Exception as e:
+            print("Ignore broken manifest {}: {}".format(manifest.manifest_path, e))
+            manifest.is_reset = True
+            return manifest
+
+        if json_obj.get('fingerprint') != manifest.fingerprint:
+            print("Output configs changed, ignore manifest: {}".format(manifest.manifest_path))
+            manifest.is_reset = True
+            return manifest
+        manifest.pages = json_obj.get('pages', {})
+        return manifest
+
+    def save(self):
+        FileUtils.create_file(self.manifest_path)
+        FileUtils.write_text(json.dumps({
+            "fingerprint": self.fingerprint,
+            "pages": self.pages,
+        }, indent=2, ensure_ascii=False), self.manifest_path)
+
+    def is_changed(self, page: Dict[str, Any]) -> bool:
+        record = self.pages.get(page.get('id'))
+        return not record or record.get('last_edited_time') != page.get('last_edited_time')
+
+    def get_removed_ids(self, pages: List[Dict[str, Any]]) -> List[str]:
+        page_ids = set([it.get('id') for it in pages])
+        return [it for it in self.pages.keys() if it not in page_ids]
+
+    def put(self, page_id: str, last_edited_time: typing.Optional[str], outputs: List[str]):
+        self.pages[page_id] = {
+            "last_edited_time": last_edited_time,
+            "outputs": outputs,
+        }
+
+    def remove(self, page_id: str):
+        """
+        Forget the page and delete its outputs.
+        """
+        self.delete_outputs(page_id)
+        self.pages.pop(page_id, None)
+
+    def delete_outputs(self, page_id: str):
+        """
+        Delete the recorded outputs of the page, e.g. before re-exporting it.
+        """
+        record = self.pages.get(page_id)
+        if not record:
+            return
+        for path in record.get('outputs', []):
+            if FileUtils.exists(path):
+                print("Delete stale output: {}".format(path))
+                FileUtils.delete(path)
+
+    @staticmethod
+    def get_output_paths(file_outputs: Dict[str, Any]) -> List[str]:
+        paths = []
+        for output in file_outputs.values():
+            for path in [getattr(output, 'markdown_path', None), getattr(output, 'properties_path', None)] \
+                    + list(getattr(output, 'asset_paths', [])):
+                if path:
+                    paths.append(path)
+        return paths
+
+    @staticmethod
+    def _get_fingerprint() -> str:
+        return json.dumps({
+            "writer": Config.writer(),
+            "channels": Config.channels(),
+            "download_image": Config.download_image(),
+            "download_assets": Config.download_assets(),
+            "optimize_images": Config.optimize_images(),
+            "image_widths": [str(it) for it in Config.image_widths()],
+            "image_format": Config.image_format(),
+            "version": Config.notion_down_version(),
+        }, sort_keys=True)
@@ -1,3 +1,6 @@
+import copy
+import html
+import json
 import os
 import re
 import typing
@@ -5,11 +8,17 @@ import urllib
 
 from slugify import slugify
 
-from notion_client import Client
 from config import Config
+from notion_cache import RunMemo, SYNCED_BLOCK_MEMO
+from notion_fetcher import NotionBlockFetcher
+from notion_transport import NotionTransport
 from utils.utils import Utils
 from utils.notion_utils import NotionUtils
 
+# Database schemas, inferred sorts and rendered tables shared by all pages within the run,
+# the same linked database is often embedded in many pages
+DATABASE_MEMO = RunMemo()
+
 
 class PageBaseBlock:
     def __init__(self):
@@ -30,6 +39,35 @@ type: {}
         return self.children is not None
 
 
+class RenderContext:
+    """
+    Passed down the block tree while rendering, so that blocks are never mutated and
+    the same page can be rendered by many writers or threads at once.
+    """
+
+    def __init__(
+            self,
+            render: typing.Optional[typing.Callable[[PageBaseBlock, 'RenderContext'], str]] = None,
+            depth=0,
+            assets: typing.Optional[list] = None):
+        # Renders a child block, e.g. NotionPageWriter._write_curr_block
+        self.render = render or RenderContext.render_block
+        self.depth = depth
+        # Assets downloaded while rendering, shared by the child contexts
+        self.assets = assets if assets is not None else []
+
+    @staticmethod
+    def render_block(block: PageBaseBlock, context: 'RenderContext') -> str:
+        return block.write_block(context) if block.is_group() else block.write_block()
+
+    def child(self) -> 'RenderContext':
+        return RenderContext(self.render, self.depth + 1, self.assets)
+
+    def write_children(self, blocks: typing.List[PageBaseBlock]) -> typing.List[str]:
+        child_context = self.child()
+        return [self.render(it, child_context) for it in blocks]
+
+
 class PageGroupBlock(PageBaseBlock):
     def __init__(self):
         super().__init__()
@@ -37,21 +75,14 @@ class PageGroupBlock(PageBaseBlock):
         self.group = 'Group'
         self.name = ''
         self.children: typing.List[PageBaseBlock] = []
-        self.on_write_children_handler: typing.Callable[[typing.List[PageBaseBlock]], str] = None
-
-    def on_write_children(self, handler: typing.Callable[[typing.List[PageBaseBlock]], str]):
-        self.on_write_children_handler = handler
-        pass
 
-    def write_block(self):
-        if not self.on_write_children_handler:
-            def handler(blocks: typing.List[PageBaseBlock])->str:
-                lines = [it.write_block() for it in blocks]
-                return "\n".join(lines)
-            self.on_write_children_handler = handler
-        text = self.on_write_children_handler(self.children)
+    def write_block(self, context: typing.Optional[RenderContext] = None):
+        text = self.write_children(context)
         return "{}\n{}\n{}".format(self.write_begin(), text, self.write_end())
 
+    def write_children(self, context: typing.Optional[RenderContext] = None) -> str:
+        return "\n".join((context or RenderContext()).write_children(self.children))
+
     def write_begin(self):
         return "<!-- {} BGN{} -->".format(self.group, '' if len(self.name) == 0 else ' ' + self.name)
 
@@ -66,14 +97,8 @@ class PageSyncedSourceBlock(PageGroupBlock):
         self.group = 'SyncedSourceBlock'
         self.children: typing.List[PageBaseBlock] = []
 
-    def write_block(self):
-        if not self.on_write_children_handler:
-            def handler(blocks: typing.List[PageBaseBlock])->str:
-                lines = [it.write_block() for it in blocks]
-                return "\n".join(lines)
-            self.on_write_children_handler = handler
-        text = self.on_write_children_handler(self.children)
-        return text
+    def write_block(self, context: typing.Optional[RenderContext] = None):
+        return self.write_children(context)
 
 
 class PageSyncedCopyBlock(PageGroupBlock):
@@ -82,10 +107,15 @@ class PageSyncedCopyBlock(PageGroupBlock):
         self.type = 'transclusion_reference'
         self.group = 'SyncedCopyBlock'
         self.children: typing.List[PageBaseBlock] = []
+        self.source_id = None
 
-    def write_block(self):
-        lines = [it.write_block() for it in self.children]
-        return "<!-- SyncedBlock: {}\nThis is a reference block. {}\n-->".format(self.name, "\n".join(lines))
+    def write_block(self, context: typing.Optional[RenderContext] = None):
+        def render():
+            # Not rendered by the writer, so that the copies of all pages and writers render the same
+            return self.write_children()
+        # Copies of the same source render the same, only once within the run
+        text = SYNCED_BLOCK_MEMO.get_or_load(('markdown', self.source_id), render) if self.source_id else render()
+        return "<!-- SyncedBlock: {}\nThis is a reference block. {}\n-->".format(self.name, text)
 
 
 class PageShortCodeBlock(PageGroupBlock):
@@ -95,9 +125,8 @@ class PageShortCodeBlock(PageGroupBlock):
         self.group = 'ShortCode'
         self.children: typing.List[PageBaseBlock] = []
 
-    def write_block(self):
-        lines = [it.write_block() for it in self.children]
-        return "<!-- ShortCode: {}\n{}\n-->".format(self.name, "\n".join(lines))
+    def write_block(self, context: typing.Optional[RenderContext] = None):
+        return "<!-- ShortCode: {}\n{}\n-->".format(self.name, self.write_children())
 
 
 class PageChannelBlock(PageGroupBlock):
@@ -121,21 +150,17 @@ class PageColumnListBlock(PageGroupBlock):
         self.group = 'ColumnList'
         self.children: typing.List[PageColumnBlock] = []
 
-    def write_block(self):
-        if not self.on_write_children_handler:
-            def handler(blocks: typing.List[PageBaseBlock])->str:
-                column_lines = []
-                for idx, column_block in enumerate(blocks):
-                    column_lines.append(
-                        "{}<!-- Column {} start -->\n{}\n<!-- Column end -->".format(
-                            "\n" if idx > 0 else "",
-                            idx,
-                            column_block.write_block()
-                        )
-                    )
-                return "\n".join(column_lines)
-            self.on_write_children_handler = handler
-        return super().write_block()
+    def write_children(self, context: typing.Optional[RenderContext] = None) -> str:
+        column_lines = []
+        for idx, column_text in enumerate((context or RenderContext()).write_children(self.children)):
+            column_lines.append(
+                "{}<!-- Column {} start -->\n{}\n<!-- Column end -->".format(
+                    "\n" if idx > 0 else "",
+                    idx,
+                    column_text
+                )
+            )
+        return "\n".join(column_lines)
 
 
 class PageColumnBlock(PageGroupBlock):
@@ -146,20 +171,15 @@ class PageColumnBlock(PageGroupBlock):
         self.children: typing.List[PageBaseBlock] = []
         self.block_joiner: PageBlockJoiner = PageBlockJoiner()
 
-    def write_block(self):
-        if not self.on_write_children_handler:
-            def handler(blocks: typing.List[PageBaseBlock])->str:
-                lines = []
-                for idx in range(len(blocks)):
-                    block = self.children[idx]
-                    if self.block_joiner.should_add_separator_before(self.children, idx):
-                        lines.append("")
-                    lines.append(block.write_block())
-                    if self.block_joiner.should_add_separator_after(self.children, idx):
-                        lines.append("")
-                return "\n".join(lines)
-        text = self.on_write_children_handler(self.children)
-        return text
+    def write_block(self, context: typing.Optional[RenderContext] = None):
+        lines = []
+        for idx, text in enumerate((context or RenderContext()).write_children(self.children)):
+            if self.block_joiner.should_add_separator_before(self.children, idx):
+                lines.append("")
+            lines.append(text)
+            if self.block_joiner.should_add_separator_after(self.children, idx):
+                lines.append("")
+        return "\n".join(lines)
 
 
 class PageTocBlock(PageBaseBlock):
@@ -365,14 +385,51 @@ class PageImageBlock(PageBaseBlock):
         self.image_caption = ''
         self.image_url = ''
         self.image_file = ''
+        # Changes when the image changes, unlike the signed url of Notion hosted files
+        self.image_version = ''
+        # 'expiry_time' of the signed url of Notion hosted files
+        self.image_expiry_time = None
 
     def write_block(self):
         return self.write_image_block(self.image_url)
 
-    def write_image_block(self, image_source):
+    def write_image_block(self, image_source, srcset: typing.Optional[typing.List[typing.Tuple[str, int]]] = None):
+        """
+        :param srcset: (source, width) of the responsive variants, written as an <img> tag if given.
+        """
+        if srcset:
+            return '<img src="{}" srcset="{}" alt="{}" loading="lazy">'.format(
+                html.escape(image_source),
+                html.escape(", ".join(["{} {}w".format(source, width) for source, width in srcset])),
+                html.escape(self.image_caption))
         return "![{}]({})".format(self.image_caption, image_source)
 
 
+class PageFileBlock(PageBaseBlock):
+    """
+    File, pdf and video blocks.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.type = 'file'
+        self.file_caption = ''
+        self.file_url = ''
+        # 'file' for Notion hosted files, 'external' for links
+        self.file_source = ''
+        self.file_version = ''
+        self.file_expiry_time = None
+
+    def write_block(self):
+        return self.write_file_block(self.file_url)
+
+    def write_file_block(self, file_source):
+        if self.type == 'video':
+            return f"Video: <{file_source}>"
+        text = self.file_caption if self.file_caption else "File"
+        return f"[{text}]({file_source})"
+
+
 class PageToggleBlock(PageTextBlock):
     def __init__(self):
         super().__init__()
@@ -407,8 +464,12 @@ class NotionPage:
         self.id = ''
         self.title = ''
         self.cover = ''
+        self.cover_version = ''
+        self.cover_expiry_time = None
+        self.last_edited_time = None
         self.blocks = []
         self.properties = {}
+        self.children_map: typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]] = {}
 
         self.mapping = {
             "paragraph": self._parse_text,
@@ -532,6 +593,7 @@ class NotionPage:
 
     def parse(self, page):
         self.id = page.get('id')
+        self.last_edited_time = page.get('last_edited_time')
         # Title extraction depends on whether it's a page or a block, but usually page
         self.title = self._get_title(page)
         
@@ -541,9 +603,13 @@ class NotionPage:
                 self.cover = cover.get('external', {}).get('url')
             elif cover.get('type') == 'file':
                 self.cover = cover.get('file', {}).get('url')
+                self.cover_expiry_time = cover.get('file', {}).get('expiry_time')
+            # Any edit moves the page's last_edited_time, the path of the signed url only changes with the cover
+            self.cover_version = str(self.cover).split('?')[0]
 
         # parse page blocks
-        # We need to fetch children blocks
+        # Prefetch the whole block tree concurrently, then parse over it
+        self._prefetch_children(self.id, page.get('last_edited_time'))
         children = self._get_children(self.id)
         self.blocks = self._parse_page_blocks(children)
         
@@ -560,19 +626,17 @@ class NotionPage:
                 return NotionUtils.get_plain_text(value.get('title', []))
         return "Untitled"
 
+    def _prefetch_children(self, block_id, last_edited_time=None):
+        try:
+            self.children_map = NotionBlockFetcher().fetch_tree(block_id, last_edited_time)
+        except Exception as e:
+            print("Prefetch block tree failed, fetch children on demand: {}".format(e))
+            self.children_map = {}
+
     def _get_children(self, block_id):
-        # TODO: Reuse client from NotionReader or create new?
-        # Creating new for now to avoid circular import issues
-        client = Client(auth=Config.notion_token())
-        children = []
-        has_more = True
-        start_cursor = None
-        while has_more:
-            response = client.blocks.children.list(block_id=block_id, start_cursor=start_cursor)
-            children.extend(response.get('results', []))
-            has_more = response.get('has_more')
-            start_cursor = response.get('next_cursor')
-        return children
+        if block_id in self.children_map:
+            return self.children_map[block_id]
+        return NotionBlockFetcher.list_children(block_id)
 
     def _parse_page_properties(self, page):
         # Parse native Notion properties
@@ -753,6 +817,8 @@ class NotionPage:
         page_block.image_caption = image_caption
         page_block.image_url = image_url
         page_block.image_file = temp_file
+        page_block.image_version = block.get('last_edited_time') if image_info.get('type') == 'file' else image_url
+        page_block.image_expiry_time = image_info.get('file', {}).get('expiry_time')
         page_blocks.append(page_block)
 
     def _parse_divider(self, page_blocks: typing.List[PageBaseBlock], block):
@@ -936,35 +1002,26 @@ class NotionPage:
         page_blocks.append(page_block)
 
     def _parse_video(self, page_blocks: typing.List[PageBaseBlock], block):
-        # Video
-        video = block.get('video', {})
-        url = ""
-        if video.get('type') == 'external':
-            url = video.get('external', {}).get('url')
-        elif video.get('type') == 'file':
-            url = video.get('file', {}).get('url')
-        
-        page_block = PageTextBlock()
-        page_block.id = block.get('id')
-        page_block.type = 'video'
-        page_block.text = f"Video: <{url}>"
-        page_blocks.append(page_block)
+        self._parse_file(page_blocks, block)
 
     def _parse_file(self, page_blocks: typing.List[PageBaseBlock], block):
-        file_info = block.get('file', {})
+        # File, pdf and video
+        block_type = block.get('type')
+        file_info = block.get(block_type, {})
         url = ""
         if file_info.get('type') == 'external':
             url = file_info.get('external', {}).get('url')
         elif file_info.get('type') == 'file':
             url = file_info.get('file', {}).get('url')
-        
-        caption = NotionUtils.get_markdown_text(file_info.get('caption', []))
-        text = caption if caption else "File"
-        
-        page_block = PageTextBlock()
+
+        page_block = PageFileBlock()
         page_block.id = block.get('id')
-        page_block.type = 'file'
-        page_block.text = f"[{text}]({url})"
+        page_block.type = block_type
+        page_block.file_caption = NotionUtils.get_markdown_text(file_info.get('caption', []))
+        page_block.file_url = url
+        page_block.file_source = file_info.get('type')
+        page_block.file_version = block.get('last_edited_time') if file_info.get('type') == 'file' else url
+        page_block.file_expiry_time = file_info.get('file', {}).get('expiry_time')
         page_blocks.append(page_block)
 
     def _parse_pdf(self, page_blocks: typing.List[PageBaseBlock], block):
@@ -1034,17 +1091,13 @@ class NotionPage:
             return
 
         try:
-            client = Client(auth=Config.notion_token())
-            # Check for SSL Ignore flag
-            ignore_ssl = os.environ.get('NOTION_IGNORE_SSL', 'false').lower() == 'true'
-            if ignore_ssl:
-                import httpx
-            
             from notion_reader import NotionReader
             client = NotionReader.get_client()
             
-            # Retrieve database schema and description
-            database = client.databases.retrieve(database_id=db_id)
+            # Retrieve database schema and description, once per run. Not persisted: neither the
+            # embedding block nor the database moves its 'last_edited_time' on every row edit
+            database = DATABASE_MEMO.get_or_load(
+                ('databases.retrieve', db_id), lambda: client.databases.retrieve(database_id=db_id))
             properties = database.get('properties', {})
             
             # Parse column weight configuration from description
@@ -1053,19 +1106,8 @@ class NotionPage:
             if column_weights:
                 print(f"[Database Parsing] Found property-order config: {column_weights}")
             
-            # Prepare HTTP client
-            http_client_req = None
-            should_close_client = False
-            
-            if ignore_ssl:
-                # Priority: if SSL ignore is requested, use our own client
-                http_client_req = httpx.Client(verify=False)
-                should_close_client = True
-            elif hasattr(client, 'client') and client.client:
-                http_client_req = client.client
-            else:
-                http_client_req = httpx.Client()
-                should_close_client = True
+            # Shared keep-alive pool, also used by the notion client
+            http_client_req = NotionTransport.get_http_client()
 
             token = Config.notion_token()
             headers_http = {
@@ -1076,8 +1118,22 @@ class NotionPage:
             
             url = f"https://api.notion.com/v1/databases/{db_id}/query"
 
+            # Only the visible columns come over the wire, see 'filter_properties' below
+            url_params = {}
+
+            def query_database(body):
+                # Not persisted either, rows carry signed file urls that expire, the rendered
+                # table is still shared within the run, see DATABASE_MEMO
+                response = http_client_req.post(url, headers=headers_http, json=body, params=url_params)
+                response.raise_for_status()
+                return response.json()
+
             # Determine sorting logic using utility class
             from utils.database_utils import DatabaseColumnOrderingUtils
+
+            if not properties:
+                # Inline Databases come without schema, reuse the one inferred from their rows earlier
+                properties = DATABASE_MEMO.get(('schema', db_id)) or {}
             
             # Check for page-order configuration in description first
             description_text = NotionUtils.get_plain_text(description)
@@ -1086,78 +1142,69 @@ class NotionPage:
             if page_order_sorts:
                 print(f"[Database Parsing] Found page-order config: {page_order_sorts}")
                 sorts = page_order_sorts
-                # Bypassing pre-query if page-order is configured
                 is_default_sort = False
             else:
                 sorts = DatabaseColumnOrderingUtils.get_database_sorts(properties)
                 print(f"[Database Parsing] Using schema-based/default sorts: {sorts}")
-                # If properties are empty (common with Inline Databases), we miss schema info for sorting.
-                # Perform a pre-query to infer schema from the first row to check for 'Order' column.
                 is_default_sort = len(sorts) == 1 and sorts[0].get('timestamp') == 'created_time'
-            
-            if not properties and is_default_sort:
-                print(f"[Database Parsing] Schema properties empty & default sort detected. Attempting Pre-query inference...")
-                # Pre-query one row to check schema
-                pre_query_body = {
-                    "page_size": 1,
-                    "sorts": sorts # Default sort
-                }
-                try:
-                    pre_response = http_client_req.post(url, headers=headers_http, json=pre_query_body)
-                    pre_response.raise_for_status()
-                    pre_results = pre_response.json().get('results', [])
-                    
-                    if pre_results:
-                        # Infer properties from row data
-                        inferred_props = pre_results[0].get('properties', {})
-                        print(f"[Database Parsing] Inferred properties from Pre-query: {list(inferred_props.keys())}")
-                        # Re-calculate sorts with inferred properties
-                        sorts = DatabaseColumnOrderingUtils.get_database_sorts(inferred_props)
-                        print(f"[Database Parsing] Recalculated sorts after inference: {sorts}")
-                    else:
-                        print("[Database Parsing] Pre-query returned no results. Cannot infer schema.")
-                except Exception as e:
-                    print(f"[Database Parsing] Failed to infer schema for sorting: {e}")
 
-            query_body = {
-                "sorts": sorts
-            }
-            
-            response = http_client_req.post(url, headers=headers_http, json=query_body)
-            
-            response.raise_for_status()
-            results = response.json().get('results', [])
-            print(f"[Database Parsing] Query returned {len(results)} rows.")
-            
-            headers = list(properties.keys()) if properties else []
-            if not headers and results:
-                # Infer headers from the first row if schema properties are empty
-                first_row_props = results[0].get('properties', {})
-                headers = list(first_row_props.keys())
-                print(f"[Database Parsing] Inferred headers from first row: {headers}")
-            
-            # Apply column ordering
-            if headers and column_weights:
-                # Only apply weighted ordering if explicitly configured
-                headers = self._sort_columns_by_weight(headers, column_weights)
-                print(f"[Database Parsing] Applied column weights. Final headers: {headers}")
-            elif headers:
-                 print(f"[Database Parsing] No column weights config. Using default headers: {headers}")
-            
-            rows = []
-            for page in results:
-                row_data = []
-                page_props = page.get('properties', {})
-                for header in headers:
-                    if header in page_props:
-                        row_data.append(self._parse_property_value(page_props[header]))
-                    else:
-                        row_data.append("")
-                rows.append(row_data)
-            
+            # If properties are empty (common with Inline Databases), we miss schema info for sorting.
+            # Query with the default sort and infer the schema from the first page of rows instead.
+            infer_schema = not properties and is_default_sort
+
+            row_limit = DatabaseColumnOrderingUtils.parse_row_limit(description_text) or int(Config.database_row_limit() or 0)
+            if row_limit > 0:
+                print(f"[Database Parsing] Row limit: {row_limit}")
+
+            query_body = {"sorts": sorts}
+            row_filter = DatabaseColumnOrderingUtils.parse_row_filter(description_text)
+            query_filter, local_conditions = DatabaseColumnOrderingUtils.build_query_filter(row_filter, properties)
+            if query_filter:
+                print(f"[Database Parsing] Found row-filter config, query filter: {query_filter}")
+                query_body["filter"] = query_filter
+            if local_conditions:
+                # Properties missing from the schema (e.g. Inline Databases), filter the rows locally
+                print(f"[Database Parsing] Row-filter conditions applied locally: {local_conditions}")
+
+            headers = self._get_database_headers(properties, column_weights) if properties else None
+            if headers is not None and len(headers) < len(properties):
+                filter_names = headers + [it['property'] for it in local_conditions]
+                url_params['filter_properties'] = [properties[it]['id'] for it in filter_names
+                                                   if properties.get(it, {}).get('id')]
+
+            def read_table():
+                fetch_limit = 0 if local_conditions else row_limit
+                pages = self._iter_database_pages(query_database, query_body, fetch_limit)
+                if infer_schema:
+                    pages = self._sort_by_inferred_schema(db_id, pages, query_database, query_body, fetch_limit)
+
+                table_headers = headers
+                rows = []
+                # Rows are rendered as their pages stream in, raw results are not kept
+                for results, _ in pages:
+                    for page in results:
+                        if table_headers is None:
+                            # Infer headers from the first row if schema properties are empty
+                            table_headers = self._get_database_headers(page.get('properties', {}), column_weights)
+                            print(f"[Database Parsing] Inferred headers from first row: {table_headers}")
+                        if local_conditions and not DatabaseColumnOrderingUtils.match_row_filter(
+                                local_conditions, self._parse_database_values(page, local_conditions)):
+                            continue
+                        rows.append(self._parse_database_row(page, table_headers))
+                        if 0 < row_limit <= len(rows):
+                            break
+                    if 0 < row_limit <= len(rows):
+                        break
+                print(f"[Database Parsing] Query returned {len(rows)} rows.")
+                return table_headers or [], rows
+
+            # Keyed by the configs the sorts and filters derive from, they stay the same once the schema is inferred
+            table_key = json.dumps([page_order_sorts, row_filter, column_weights, row_limit], sort_keys=True)
+            table_headers, rows = DATABASE_MEMO.get_or_load(('databases.query', db_id, table_key), read_table)
+
             page_block = PageTableBlock()
             page_block.id = block.get('id')
-            page_block.set_data(headers, rows)
+            page_block.set_data(list(table_headers), [list(it) for it in rows])
             page_blocks.append(page_block)
 
         except Exception as e:
@@ -1167,9 +1214,78 @@ class NotionPage:
             page_block.type = 'collection_view_error'
             page_block.text = f"Error parsing database: {e}"
             page_blocks.append(page_block)
-        finally:
-            if should_close_client and http_client_req:
-                http_client_req.close()
+
+    def _get_database_headers(self, properties, column_weights):
+        headers = list(properties.keys()) if properties else []
+        if headers and column_weights:
+            # Only apply weighted ordering if explicitly configured
+            headers = self._sort_columns_by_weight(headers, column_weights)
+            print(f"[Database Parsing] Applied column weights. Final headers: {headers}")
+        elif headers:
+            print(f"[Database Parsing] No column weights config. Using default headers: {headers}")
+        return headers
+
+    def _parse_database_row(self, page, headers):
+        page_props = page.get('properties', {})
+        return [self._parse_property_value(page_props[header]) if header in page_props else ""
+                for header in headers]
+
+    def _parse_database_values(self, page, conditions):
+        page_props = page.get('properties', {})
+        return {it['property']: self._parse_property_value(page_props[it['property']])
+                for it in conditions if it['property'] in page_props}
+
+    @staticmethod
+    def _iter_database_pages(query_database, body, row_limit=0):
+        """
+        Yield (rows, has_more) of a database query page by page, following 'next_cursor'.
+        Stops after row_limit rows if it is positive.
+        """
+        count = 0
+        start_cursor = None
+        while True:
+            page_size = 100 if row_limit <= 0 else min(100, row_limit - count)
+            query_body = dict(body, page_size=page_size)
+            if start_cursor:
+                query_body['start_cursor'] = start_cursor
+            response = query_database(query_body)
+            results = response.get('results', [])
+            if row_limit > 0:
+                results = results[:row_limit - count]
+            count += len(results)
+            start_cursor = response.get('next_cursor')
+            has_more = bool(response.get('has_more') and start_cursor)
+            yield results, has_more
+            if not has_more or 0 < row_limit <= count:
+                return
+
+    @staticmethod
+    def _sort_by_inferred_schema(db_id, pages, query_database, body, row_limit=0):
+        """
+        Infer the schema from the first page of rows queried with the default sort, and
+        apply the sorts it implies (e.g. an 'Order' column): locally if all rows are in
+        the first page, otherwise by querying again with those sorts.
+        """
+        from utils.database_utils import DatabaseColumnOrderingUtils
+
+        first_results, has_more = next(pages, ([], False))
+        if not first_results:
+            print("[Database Parsing] Query returned no results. Cannot infer schema.")
+            return
+        inferred_props = DATABASE_MEMO.get_or_load(('schema', db_id), lambda: first_results[0].get('properties', {}))
+        print(f"[Database Parsing] Inferred properties from first row: {list(inferred_props.keys())}")
+        sorts = DatabaseColumnOrderingUtils.get_database_sorts(inferred_props)
+        if sorts == body.get('sorts'):
+            yield first_results, has_more
+            yield from pages
+            return
+
+        print(f"[Database Parsing] Recalculated sorts after inference: {sorts}")
+        if not has_more:
+            yield DatabaseColumnOrderingUtils.sort_rows(first_results, sorts), False
+            return
+        pages.close()
+        yield from NotionPage._iter_database_pages(query_database, dict(body, sorts=sorts), row_limit)
 
     def _parse_property_value(self, prop_value):
         """Parse various property types to string"""
@@ -1324,6 +1440,8 @@ class NotionPage:
                 children = self._get_children(block.get('id'))
                 for child in children:
                     self._parse_page_blocks_flatt(column_blocks, child)
+                # Copies of this source in other pages reuse the parsed content
+                SYNCED_BLOCK_MEMO.get_or_load(block.get('id'), lambda: copy.deepcopy(column_blocks))
             
             page_blocks.append(page_block)
         else:
@@ -1341,19 +1459,27 @@ class NotionPage:
             # Actually, for synced block copy, we usually want to render the content.
             # If `has_children` is true, we can just fetch them.
             
-            column_blocks: typing.List[PageBaseBlock] = []
-            page_block.children = column_blocks
-            
-            if block.get('has_children'):
-                children = self._get_children(block.get('id'))
-                for child in children:
-                    self._parse_page_blocks_flatt(column_blocks, child)
-            elif synced_from:
-                 # Fetch from source
-                 source_id = synced_from.get('block_id')
-                 children = self._get_children(source_id)
-                 for child in children:
-                    self._parse_page_blocks_flatt(column_blocks, child)
+            source_id = synced_from.get('block_id')
+
+            def parse_children():
+                column_blocks: typing.List[PageBaseBlock] = []
+                if block.get('has_children'):
+                    children = self._get_children(block.get('id'))
+                    for child in children:
+                        self._parse_page_blocks_flatt(column_blocks, child)
+                elif source_id:
+                    # Fetch from source
+                    children = self._get_children(source_id)
+                    for child in children:
+                        self._parse_page_blocks_flatt(column_blocks, child)
+                return column_blocks
+
+            if source_id:
+                # The source is fetched and parsed once within the run, every copy gets its own blocks
+                page_block.source_id = source_id
+                page_block.children = copy.deepcopy(SYNCED_BLOCK_MEMO.get_or_load(source_id, parse_children))
+            else:
+                page_block.children = parse_children()
 
             page_blocks.append(page_block)
 
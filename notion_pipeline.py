@@ -0,0 +1,78 @@
+import queue
+import threading
+import traceback
+import typing
+
+# Items in flight between two stages, bounds the pages held in memory
+PIPELINE_QUEUE_SIZE = 4
+
+STAGE_END = object()
+
+
+class PipelineStage:
+    """
+    Worker threads consuming the items of a bounded queue with the handler.
+
+    put() blocks while the queue is full, so a slow stage throttles the stage feeding it.
+    The first error of the handler is raised from put() and close(), the items after it
+    are drained but skipped.
+    """
+
+    def __init__(self, name: str, handler: typing.Callable[[typing.Any], None],
+                 workers: int = 1, maxsize: int = PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=max(1, maxsize))
+        self.error: typing.Optional[BaseException] = None
+        self.threads = [
+            threading.Thread(target=self._run, name="{}-{}".format(name, it), daemon=True)
+            for it in range(max(1, workers))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self._raise_error()
+        self.queue.put(item)
+
+    def close(self):
+        """
+        Wait for all queued items to be handled.
+        """
+        for _ in self.threads:
+            self.queue.put(STAGE_END)
+        for thread in self.threads:
+            thread.join()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is STAGE_END:
+                return
+            if self.error:
+                continue
+            try:
+                self.handler(item)
+            except Exception as e:
+                print("Pipeline stage '{}' failed: {}".format(self.name, e))
+                traceback.print_exc()
+                if not self.error:
+                    self.error = e
+
+    def _raise_error(self):
+        if self.error:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not exc_type:
+            self.close()
+            return
+        # Already failing, do not mask the original error
+        try:
+            self.close()
+        except Exception:
+            pass
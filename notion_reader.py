@@ -1,30 +1,90 @@
-import re
+import asyncio
+import threading
+import traceback
 import typing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
 from notion_client import Client
 from config import Config
+from notion_cache import NotionApiCache
+from notion_fetcher import NotionBlockFetcher
+from notion_index import NotionPageIndex
 from notion_page import NotionPage
+from notion_transport import NotionTransport
+from utils.title_filter import TitleFilter
 from utils.utils import Utils
 from utils.notion_utils import NotionUtils
 
 if not Utils.check_module_installed("notion_client"):
     raise Exception("Pls call 'pip install notion-client' first!")
 
-NOTION_CLIENT = None
+# Memo of the scoped pages within this run, keyed by blog_url
+SCOPED_PAGES = None
+SCOPED_PAGES_KEY = None
+TITLE_INDEX = None
+SCOPED_PAGES_LOCK = threading.RLock()
+
+
+class PostParseQueue:
+    """
+    Pages submitted for parsing, in order, shared by NotionReader.iter_posts and aiter_posts
+    which only differ in how they wait for a page.
+
+    At most 2 * jobs pages are in flight, and no more than still needed for 'limit'.
+    Pages failing to parse are counted and skipped, they do not count towards 'limit'.
+    """
+
+    def __init__(self, page_blocks: typing.Iterable[Dict[str, Any]], jobs: int, limit: typing.Optional[int],
+                 submit: typing.Callable[[Dict[str, Any]], typing.Any]):
+        self.page_iter = iter(page_blocks)
+        self.jobs = jobs
+        self.limit = limit
+        self.submit = submit
+        self.pending = deque()
+        self.count = 0
+        self.failed = 0
+
+    def next_future(self):
+        """
+        :return: the future of the next page in order, None once all pages (or 'limit' of them) are parsed.
+        """
+        parsed = self.count - self.failed
+        if self.limit is not None and parsed >= self.limit:
+            self._report()
+            return None
+        window = self.jobs * 2 if self.limit is None else min(self.jobs * 2, self.limit - parsed)
+        while len(self.pending) < window:
+            page = next(self.page_iter, None)
+            if page is None:
+                break
+            self.pending.append(self.submit(page))
+        if not self.pending:
+            self._report()
+            return None
+        return self.pending.popleft()
+
+    def on_parsed(self, notion_page: typing.Optional[NotionPage]) -> typing.Optional[NotionPage]:
+        self.count += 1
+        if not notion_page:
+            self.failed += 1
+        return notion_page
+
+    def cancel(self):
+        for future in self.pending:
+            future.cancel()
+
+    def _report(self):
+        if self.failed > 0:
+            print("{} of {} pages failed to parse".format(self.failed, self.count))
 
 
 class NotionReader:
 
     @staticmethod
     def get_client() -> Client:
-        global NOTION_CLIENT
-        if not NOTION_CLIENT:
-            if not Config.notion_token():
-                raise Exception('notion_token should be presented!')
-
-            NOTION_CLIENT = Client(auth=Config.notion_token())
-        return NOTION_CLIENT
+        return NotionTransport.get_client()
 
     @staticmethod
     def handle_post() -> List[NotionPage]:
@@ -33,13 +93,76 @@ class NotionReader:
         page_blocks = NotionReader._read_post_pages()
 
         print("parse all pages")
-        notion_pages = []
-        for page in page_blocks:
-            notion_pages.append(NotionReader._parse_page(page))
+        notion_pages = NotionReader.parse_pages(page_blocks)
 
         print("Done\n\n")
         return notion_pages
 
+    @staticmethod
+    def iter_posts(
+            page_blocks: typing.Optional[typing.Iterable[Dict[str, Any]]] = None,
+            limit: typing.Optional[int] = None) -> typing.Iterator[NotionPage]:
+        """
+        Lazily parse the post pages (or the given page_blocks) and yield them in order.
+
+        Pages are parsed on a pool of 'jobs' workers, at most 2 * jobs of them ahead of the consumer,
+        and no more than needed for 'limit' pages. Stopping early (limit reached, break or close())
+        cancels the pages not started yet, so no more API calls are issued for them.
+        A page failing to parse is reported and skipped, the others go on.
+        """
+        if page_blocks is None:
+            page_blocks = NotionReader._read_post_pages()
+
+        jobs = max(1, int(Config.jobs()))
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        parse_queue = PostParseQueue(
+            page_blocks, jobs, limit, lambda page: executor.submit(NotionReader._try_parse_page, page))
+        try:
+            future = parse_queue.next_future()
+            while future:
+                notion_page = parse_queue.on_parsed(future.result())
+                if notion_page:
+                    yield notion_page
+                future = parse_queue.next_future()
+        finally:
+            parse_queue.cancel()
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    async def aiter_posts(
+            page_blocks: typing.Optional[typing.Iterable[Dict[str, Any]]] = None,
+            limit: typing.Optional[int] = None) -> typing.AsyncIterator[NotionPage]:
+        """
+        Async version of iter_posts, pages are parsed on worker threads off the event loop.
+        Cancelling the consuming task (or aclose()) cancels the pages not started yet
+        without waiting for the ones in progress.
+        """
+        loop = asyncio.get_running_loop()
+        if page_blocks is None:
+            page_blocks = await loop.run_in_executor(None, NotionReader._read_post_pages)
+
+        jobs = max(1, int(Config.jobs()))
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        parse_queue = PostParseQueue(
+            page_blocks, jobs, limit, lambda page: loop.run_in_executor(executor, NotionReader._try_parse_page, page))
+        try:
+            future = parse_queue.next_future()
+            while future:
+                notion_page = parse_queue.on_parsed(await future)
+                if notion_page:
+                    yield notion_page
+                future = parse_queue.next_future()
+        finally:
+            parse_queue.cancel()
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def parse_pages(page_blocks: typing.List[Dict[str, Any]]) -> List[NotionPage]:
+        """
+        Parse pages on a pool of 'jobs' workers, the results keep the order of page_blocks.
+        """
+        return list(NotionReader.iter_posts(page_blocks))
+
     @staticmethod
     def handle_page_with_title(page_title: str) -> typing.Optional[NotionPage]:
         print("#handle_page_with_title: " + page_title)
@@ -85,126 +208,165 @@ class NotionReader:
     def read_page_with_title(page_title: str) -> typing.Optional[Dict[str, Any]]:
         print("#read_page_with_title")
         
-        # Get pages within scope (Global or Blog-scoped)
-        scoped_pages = NotionReader._get_scoped_pages()
-        
-        # Find the page in the scoped list
-        return Utils.find_one(scoped_pages, lambda it: NotionReader._get_page_title(it) == page_title)
+        # Find the page within scope (Global or Blog-scoped)
+        return NotionReader._get_title_index().get(page_title)
 
     @staticmethod
-    def _read_post_pages() -> typing.List[Dict[str, Any]]:
-        # Get valid pages (scoped)
-        page_blocks = NotionReader._get_scoped_pages()
+    def read_pages_with_titles(page_titles: typing.List[str]) -> typing.Dict[str, typing.Optional[Dict[str, Any]]]:
+        """
+        Batch version of read_page_with_title, the scoped pages are only scanned once.
+
+        :return: title -> page (None if not found), in the order of page_titles.
+        """
+        print("#read_pages_with_titles")
+        title_index = NotionReader._get_title_index()
+        return {title: title_index.get(title) for title in page_titles}
 
+    @staticmethod
+    def _read_post_pages() -> typing.List[Dict[str, Any]]:
         # filter by config
         titles = Config.page_titles()
         titles_match = Config.page_titles_match() or []
         if titles == ['all'] and (not titles_match or len(titles_match) == 0):
-            return page_blocks
-
-        filter_by_titles = [it for it in page_blocks if NotionReader._get_page_title(it) in titles]
-        filter_by_titles_match = [it for it in page_blocks if Utils.find_one(
-            titles_match,
-            lambda match: re.compile(match).match(NotionReader._get_page_title(it))
-        )]
-        filter_by_titles.extend([it for it in filter_by_titles_match if it not in filter_by_titles])
+            # Get valid pages (scoped)
+            return NotionReader._get_scoped_pages()
+
+        # Exact titles are searched directly, only regex matching needs the full scan
+        filter_by_titles = NotionReader._search_pages_with_titles(titles) if titles != ['all'] else []
+        if not titles_match:
+            return filter_by_titles
+
+        page_ids = set([it.get('id') for it in filter_by_titles])
+        title_filter = TitleFilter(titles_match)
+        for page, pattern in title_filter.filter(
+                NotionReader._get_scoped_pages(), NotionReader._get_page_title, lambda it: it.get('id')):
+            if page.get('id') not in page_ids:
+                print("Page '{}' matches '{}'".format(NotionReader._get_page_title(page), pattern))
+                page_ids.add(page.get('id'))
+                filter_by_titles.append(page)
         return filter_by_titles
-    
+
+    @staticmethod
+    def _search_pages_with_titles(page_titles: typing.List[str]) -> typing.List[Dict[str, Any]]:
+        """
+        Resolve exact page titles with one targeted Search API query per title, run concurrently.
+        Results are post-filtered by exact title match and by the blog_url scope.
+        """
+        root_id = NotionUtils.extract_id(Config.blog_url()) if Config.blog_url() else None
+
+        def search(page_title):
+            pages = [it for it in NotionReader._search_all_pages(page_title)
+                     if NotionReader._get_page_title(it) == page_title]
+            if root_id:
+                pages = [it for it in pages if NotionReader._is_descendant(it, root_id)]
+            return pages
+
+        with ThreadPoolExecutor(max_workers=max(1, int(Config.fetch_concurrency()))) as executor:
+            results = list(executor.map(search, page_titles))
+
+        page_blocks = []
+        page_ids = set()
+        for pages in results:
+            for page in pages:
+                if page.get('id') not in page_ids:
+                    page_ids.add(page.get('id'))
+                    page_blocks.append(page)
+        return page_blocks
+
+    @staticmethod
+    def _search_all_pages(query: str) -> typing.List[Dict[str, Any]]:
+        pages = []
+        has_more = True
+        start_cursor = None
+        while has_more:
+            response = NotionReader.get_client().search(
+                query=query,
+                filter={"value": "page", "property": "object"},
+                start_cursor=start_cursor,
+                page_size=100
+            )
+            pages.extend(response.get('results', []))
+            has_more = response.get('has_more')
+            start_cursor = response.get('next_cursor')
+        return pages
+
+    @staticmethod
+    def _is_descendant(page: Dict[str, Any], root_id: str) -> bool:
+        """
+        Walk up the parent chain of the page (pages, databases and blocks) looking for root_id.
+        Parents are looked up in the persisted page index first.
+        """
+        index = NotionPageIndex.get_instance()
+        root_id = NotionPageIndex.normalize_id(root_id)
+        if NotionPageIndex.normalize_id(page.get('id')) == root_id:
+            return True
+
+        node = NotionPageIndex.get_parent(page)
+        visited = set()
+        while node and node not in visited:
+            if node[1] == root_id:
+                return True
+            visited.add(node)
+            node = index.resolve_parent(node)
+        return False
+
     @staticmethod
     def _get_scoped_pages() -> typing.List[Dict[str, Any]]:
         """
-        Retrieves all pages based on the configuration scope.
+        Retrieves all pages based on the configuration scope, memoized within the run.
+        """
+        global SCOPED_PAGES, SCOPED_PAGES_KEY, TITLE_INDEX
+        with SCOPED_PAGES_LOCK:
+            if SCOPED_PAGES is None or SCOPED_PAGES_KEY != Config.blog_url():
+                SCOPED_PAGES = NotionReader._read_scoped_pages()
+                SCOPED_PAGES_KEY = Config.blog_url()
+                TITLE_INDEX = None
+            return SCOPED_PAGES
+
+    @staticmethod
+    def _get_title_index() -> typing.Dict[str, Dict[str, Any]]:
+        """
+        :return: title -> first scoped page with this title.
+        """
+        global TITLE_INDEX
+        with SCOPED_PAGES_LOCK:
+            scoped_pages = NotionReader._get_scoped_pages()
+            if TITLE_INDEX is None:
+                title_index = {}
+                for page in scoped_pages:
+                    title_index.setdefault(NotionReader._get_page_title(page), page)
+                TITLE_INDEX = title_index
+            return TITLE_INDEX
+
+    @staticmethod
+    def _read_scoped_pages() -> typing.List[Dict[str, Any]]:
+        """
         - If blog_url is set: Fetch all -> Filter descendants of blog_url.
         - If blog_url is NOT set: Fetch all (Workspace scope).
         """
-        # 1. Fetch ALL pages in workspace (Search API)
-        all_pages = NotionReader._get_all_pages_in_workspace()
-        
-        # 2. Apply Scope
         if Config.blog_url():
             print("Scope: filtering pages under blog_url...")
             root_id = NotionUtils.extract_id(Config.blog_url())
-            return NotionReader._filter_descendants(all_pages, root_id)
+            return NotionPageIndex.get_instance().get_descendants(root_id)
         
         print("Scope: global workspace")
-        return all_pages
+        return NotionReader._get_all_pages_in_workspace()
 
     @staticmethod
     def _get_all_pages_in_workspace() -> typing.List[Dict[str, Any]]:
         """
-        Fetches ALL pages in the workspace using the Search API with pagination.
+        Fetches ALL pages in the workspace, see NotionPageIndex for the delta refresh.
         """
-        all_pages = []
-        has_more = True
-        start_cursor = None
-        
-        print("Searching all pages in workspace...")
-        while has_more:
-            # Search for pages only
-            response = NotionReader.get_client().search(
-                filter={"value": "page", "property": "object"},
-                start_cursor=start_cursor,
-                page_size=100
-            )
-            results = response.get('results', [])
-            all_pages.extend(results)
-            has_more = response.get('has_more')
-            start_cursor = response.get('next_cursor')
-            print(f"Fetched {len(results)} pages, total so far: {len(all_pages)}")
-            
-        return all_pages
+        return NotionPageIndex.get_instance().get_pages()
 
     @staticmethod
     def _filter_descendants(all_pages: typing.List[Dict[str, Any]], root_id: str) -> typing.List[Dict[str, Any]]:
         """
         Filters the list of all pages to return only those that are descendants of the root_id.
-        Reconstructs the tree structure in memory.
+        Only the parents among all_pages are followed, see NotionPageIndex.get_descendants for the full hierarchy.
         """
-        # Normalize root_id
-        if not root_id:
-            return []
-        root_id = root_id.replace('-', '')
-        
-        # Build children map: parent_id -> list of child pages
-        children_map = {}
-        page_map = {}
-        
-        for page in all_pages:
-            pid = page.get('id').replace('-', '')
-            page_map[pid] = page
-            
-            parent = page.get('parent')
-            if parent and parent.get('type') == 'page_id':
-                parent_id = parent.get('page_id').replace('-', '')
-                if parent_id not in children_map:
-                    children_map[parent_id] = []
-                children_map[parent_id].append(page)
-
-        # BFS to find all descendants
-        descendants = []
-        queue = [root_id]
-        visited = set()
-        
-        while queue:
-            current_id = queue.pop(0)
-            if current_id in visited:
-                continue
-            visited.add(current_id)
-            
-            # If current_id is in page_map (and it's not the root iterator start), add it
-            # (We want to include root if it is in all_pages? The caller handles root usually, 
-            # but let's gather everything reachable. 
-            # If root_id is the main page content, we usually want it.
-            if current_id in page_map:
-                descendants.append(page_map[current_id])
-            
-            # Add children to queue
-            if current_id in children_map:
-                for child in children_map[current_id]:
-                    child_id = child.get('id').replace('-', '')
-                    queue.append(child_id)
-                    
-        return descendants
+        children_map = NotionPageIndex.build_children_map(all_pages, {})
+        return NotionPageIndex.bfs_descendants(all_pages, children_map, root_id)
 
     @staticmethod
     def _recurse_read_page(page_blocks: typing.List[Dict[str, Any]], parent_page: Dict[str, Any]):
@@ -229,31 +391,35 @@ class NotionReader:
             if child.get('type') == 'child_page':
                 # It's a subpage. Retrieve the full page details.
                 try:
-                    child_page_details = NotionReader.get_client().pages.retrieve(child.get('id'))
+                    child_page_details = NotionApiCache.cached(
+                        'pages.retrieve',
+                        child.get('id'),
+                        child.get('last_edited_time'),
+                        lambda: NotionReader.get_client().pages.retrieve(child.get('id'))
+                    )
                     NotionReader._recurse_read_page(page_blocks, child_page_details)
                 except Exception as e:
                     print(f"Error retrieving subpage {child.get('id')}: {e}")
 
     @staticmethod
     def _get_children(block_id: str) -> List[Dict[str, Any]]:
-        children = []
-        has_more = True
-        start_cursor = None
-        
-        while has_more:
-            response = NotionReader.get_client().blocks.children.list(
-                block_id=block_id,
-                start_cursor=start_cursor
-            )
-            children.extend(response.get('results', []))
-            has_more = response.get('has_more')
-            start_cursor = response.get('next_cursor')
-            
-        return children
+        return NotionBlockFetcher.list_children(block_id)
+
+    @staticmethod
+    def _try_parse_page(page: Dict[str, Any]) -> typing.Optional[NotionPage]:
+        try:
+            return NotionReader._parse_page(page)
+        except Exception as e:
+            print("Parse page failed, id = {}: {}".format(page.get('id'), e))
+            traceback.print_exc()
+            return None
 
     @staticmethod
     def _parse_page(page: Dict[str, Any]) -> NotionPage:
         print("parse page, id = " + page.get('id'))
+        if NotionApiCache.has_expired_urls(page):
+            # Page objects of the persisted page index keep the signed urls (e.g. covers) they were indexed with
+            page = NotionReader.get_client().pages.retrieve(page_id=page.get('id'))
         notion_page = NotionPage()
         notion_page.parse(page)
         return notion_page
@@ -0,0 +1,161 @@
+import email.utils
+import os
+import random
+import threading
+import time
+import typing
+
+import httpx
+from notion_client import Client
+
+from config import Config
+from utils.rate_limiter import TokenBucket
+from utils.utils import Utils
+
+HTTP_CLIENT = None
+NOTION_CLIENT = None
+TRANSPORT_LOCK = threading.Lock()
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 60.0
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """
+    Schedule every request through a shared token bucket.
+
+    Throttled (429) and server error (5xx) responses are retried, waiting for 'Retry-After'
+    when the server sends it, otherwise for a jittered exponential backoff.
+    'Retry-After' is capped at max_retry_after so that a bogus header cannot stall every thread.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, bucket: TokenBucket, max_retries: int,
+                 max_retry_after: float = RETRY_BACKOFF_MAX):
+        self.transport = transport
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise e
+                delay = self._get_backoff(attempt)
+                print("Request {} failed: {}, retry in {:.1f}s".format(request.url, e, delay))
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                retry_after = self._get_retry_after(response)
+                if retry_after is not None:
+                    delay = min(retry_after, self.max_retry_after)
+                else:
+                    delay = self._get_backoff(attempt)
+                response.close()
+                if response.status_code == 429:
+                    # Throttled for the whole integration, hold back the other threads too
+                    self.bucket.pause(delay)
+                print("Request {} got {}, retry in {:.1f}s".format(request.url, response.status_code, delay))
+            attempt += 1
+            time.sleep(delay)
+
+    def close(self):
+        self.transport.close()
+
+    @staticmethod
+    def _get_backoff(attempt: int) -> float:
+        return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt)))
+
+    @staticmethod
+    def _get_retry_after(response: httpx.Response) -> typing.Optional[float]:
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class NotionTransport:
+    """
+    Process-wide HTTP transport shared by every Notion API call.
+
+    One keep-alive connection pool is created lazily and reused by the Notion SDK client
+    and the raw requests (e.g. database query), so requests don't pay for new TLS handshakes.
+    All requests are scheduled by RateLimitedTransport at 'rate_limit' requests per second.
+    """
+
+    @staticmethod
+    def get_http_client() -> httpx.Client:
+        global HTTP_CLIENT
+        if not HTTP_CLIENT:
+            with TRANSPORT_LOCK:
+                if not HTTP_CLIENT:
+                    HTTP_CLIENT = NotionTransport._create_http_client()
+        return HTTP_CLIENT
+
+    @staticmethod
+    def get_client() -> Client:
+        global NOTION_CLIENT
+        if not NOTION_CLIENT:
+            if not Config.notion_token():
+                raise Exception('notion_token should be presented!')
+            http_client = NotionTransport.get_http_client()
+            with TRANSPORT_LOCK:
+                if not NOTION_CLIENT:
+                    NOTION_CLIENT = Client(
+                        auth=Config.notion_token(),
+                        client=http_client,
+                        timeout_ms=int(Config.http_timeout()) * 1000,
+                    )
+        return NOTION_CLIENT
+
+    @staticmethod
+    def close():
+        global HTTP_CLIENT, NOTION_CLIENT
+        with TRANSPORT_LOCK:
+            if HTTP_CLIENT:
+                HTTP_CLIENT.close()
+            HTTP_CLIENT = None
+            NOTION_CLIENT = None
+
+    @staticmethod
+    def _create_http_client() -> httpx.Client:
+        pool_size = max(1, int(Config.http_pool_size()))
+        http2 = bool(Config.http2())
+        if http2 and not Utils.check_module_installed("h2"):
+            print("HTTP/2 disabled, pls exec 'pip install httpx[http2]' first!")
+            http2 = False
+
+        transport = httpx.HTTPTransport(
+            http2=http2,
+            verify=not NotionTransport.is_ignore_ssl(),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+        )
+        return httpx.Client(
+            transport=RateLimitedTransport(
+                transport,
+                TokenBucket(float(Config.rate_limit())),
+                max(0, int(Config.max_retries())),
+                max(0.0, float(Config.max_retry_after())),
+            ),
+            timeout=httpx.Timeout(int(Config.http_timeout())),
+        )
+
+    @staticmethod
+    def is_ignore_ssl() -> bool:
+        return os.environ.get('NOTION_IGNORE_SSL', 'false').lower() == 'true'
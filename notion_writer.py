@@ -1,15 +1,17 @@
+import html
 import json
 import re
 import os
 from pathlib import Path
 
-import requests
 import typing
 
 from slugify import slugify
 
 from config import Config
-from notion_page import NotionPage, PageBaseBlock, PageImageBlock, PageBlockJoiner
+from notion_assets import DownloadManager, ImageOptimizer
+from notion_page import NotionPage, PageBaseBlock, PageImageBlock, PageFileBlock, PageBlockJoiner, RenderContext
+from utils.image_utils import ImageUtils
 from utils.utils import FileUtils, Utils
 
 
@@ -41,6 +43,10 @@ class NotionFileOutput(NotionDirOutput):
         super().__init__()
         self.markdown_path = ""
         self.properties_path = ""
+        # Downloaded assets linked into the output dir
+        self.asset_paths: typing.List[str] = []
+        # Variant file path -> its srcset source in the markdown, see NotionWriter.drop_failed_variants
+        self.variant_sources: typing.Dict[str, str] = {}
 
     def has_markdown(self):
         return self.markdown_path and FileUtils.exists(self.markdown_path)
@@ -54,6 +60,7 @@ class NotionFileOutput(NotionDirOutput):
             "output_dir": self.output_dir,
             "markdown_path": self.markdown_path,
             "properties_path": self.properties_path,
+            "asset_paths": self.asset_paths,
         }, indent=2)
 
 
@@ -70,16 +77,33 @@ class NotionWriter:
             return HexoWriter()
         return ChannelWriter(writer)
 
+    @staticmethod
+    def get_writers() -> typing.List[str]:
+        """
+        :return: the configured writers, 'writer' is a list or divided by '|', e.g. 'notion|hexo'.
+        """
+        writers = Config.writer()
+        if not isinstance(writers, list):
+            writers = str(writers).split("|")
+        return [str(it).strip() for it in writers if it and str(it).strip()]
+
     @staticmethod
     def clean_output():
         FileUtils.clean_dir(Config.output())
 
     # noinspection SpellCheckingInspection
     @staticmethod
-    def handle_page(notion_page: NotionPage) -> typing.Dict[str, NotionFileOutput]:
+    def handle_page(notion_page: NotionPage, download_manager=None) -> typing.Dict[str, NotionFileOutput]:
+        """
+        :param download_manager: DownloadManager to download images in the background, downloaded inline if None.
+        """
         print("Write page: " + notion_page.get_identify())
+        # Writers share the rendered blocks of the page, each only adds its own header, tail and channels
+        render_cache = {}
         if not Config.writer():
             page_writer = NotionWriter.get_page_writer()
+            page_writer.image_downloader.download_manager = download_manager
+            page_writer.render_cache = render_cache
             if not page_writer.is_markdown_able(notion_page):
                 print("Skip non-markdownable page: " + notion_page.get_identify())
                 return {}
@@ -88,6 +112,9 @@ class NotionWriter:
                 return {}
 
             output = page_writer.write_page(notion_page)
+            if not download_manager:
+                # Downloaded inline, the variants are already encoded
+                NotionWriter.drop_failed_variants(output)
             print("\n----------\n")
             return {
                 "default": output
@@ -95,9 +122,10 @@ class NotionWriter:
 
         else:
             outputs = {}
-            # FIXME: fix return structure
-            for writer in [Config.writer()]:
+            for writer in NotionWriter.get_writers():
                 page_writer = NotionWriter.get_page_writer(writer)
+                page_writer.image_downloader.download_manager = download_manager
+                page_writer.render_cache = render_cache
                 if not page_writer.is_markdown_able(notion_page):
                     print("Skip non-markdownable page: " + notion_page.get_identify())
                     outputs[writer] = {}
@@ -108,10 +136,38 @@ class NotionWriter:
                     continue
 
                 output = page_writer.write_page(notion_page)
+                if not download_manager:
+                    NotionWriter.drop_failed_variants(output)
                 outputs[writer] = output
             print("\n----------\n")
             return outputs
 
+    @staticmethod
+    def drop_failed_variants(output: NotionFileOutput, download_manager: typing.Optional[DownloadManager] = None):
+        """
+        Remove the variants that could not be encoded from the srcset of the written markdown.
+        Waits for the variants, call it once the downloads are done, e.g. after DownloadManager.wait.
+        """
+        if not output.variant_sources:
+            return
+        download_manager = download_manager or DownloadManager.get_instance()
+        failed = set()
+        for variant_path, source in output.variant_sources.items():
+            future = download_manager.get_variant_future(variant_path)
+            if not future or not future.result():
+                failed.add(source)
+        if not failed or not output.has_markdown():
+            return
+
+        def drop(match):
+            sources = [it for it in html.unescape(match.group(1)).split(", ") if it.rsplit(" ", 1)[0] not in failed]
+            return ' srcset="{}"'.format(html.escape(", ".join(sources))) if sources else ''
+
+        with open(output.markdown_path, encoding='utf-8') as f:
+            text = f.read()
+        with open(output.markdown_path, 'w', encoding='utf-8') as f:
+            f.write(re.sub(r' srcset="([^"]*)"', drop, text))
+
     # noinspection SpellCheckingInspection
     @staticmethod
     def handle_pages(notion_pages: typing.List[NotionPage]) -> typing.Dict[str, NotionDirOutput]:
@@ -147,6 +203,10 @@ class NotionWriter:
 
 
 class ImageDownloader:
+    def __init__(self):
+        # Downloads run in the background on this manager when set, see main.export_pages
+        self.download_manager: typing.Optional[DownloadManager] = None
+
     def need_download_image(self, block) -> bool:
         if not Config.download_image():
             return False
@@ -156,20 +216,56 @@ class ImageDownloader:
             return False
         return 'keep-url-source=true' not in str(block.image_url).lower()
 
-    def download_image(self, image_url: str, image_file):
-        if FileUtils.exists(image_file):
-            FileUtils.delete(image_file)
-        FileUtils.create_file(image_file)
-        # if image_url.startswith("https://"):
-        #     image_url = image_url.replace("https://", "http://")
-        try:
-            r = requests.get(image_url, allow_redirects=True, timeout=(5, 10))
-            open(image_file, 'wb').write(r.content)
-        except requests.exceptions.RequestException as e:
-            print(e)
-        pass
+    def need_download_file(self, block) -> bool:
+        """
+        Notion hosted files, pdfs and videos, external ones (e.g. YouTube) keep their links.
+        """
+        if not Config.download_assets():
+            return False
+        if not isinstance(block, PageFileBlock) or block.file_source != 'file':
+            return False
+        return str(block.file_url).startswith("http")
 
-    def get_image_path(self, image_url, image_caption, def_ext='.jpg') -> str:
+    def download_image(self, image_url: str, image_file, block_id=None, version=None, expiry_time=None,
+                       property_name=None, variants=None):
+        """
+        Download the image to image_file, through the AssetStore if the owning block is known.
+
+        :param variants: max width -> file path of the optimized variants, see get_variant_paths.
+        """
+        self.download_asset(image_url, image_file, block_id, version, expiry_time, property_name, variants)
+
+    def download_asset(self, url: str, file_path, block_id=None, version=None, expiry_time=None,
+                       property_name=None, variants=None):
+        """
+        Download any asset to file_path, see download_image.
+
+        :param property_name: the asset is a property of the page block_id, e.g. 'cover'.
+        """
+        download_manager = self.download_manager or DownloadManager.get_instance()
+        if block_id:
+            future = download_manager.submit_asset(
+                block_id, version or url, url, file_path, expiry_time, property_name, variants)
+        else:
+            future = download_manager.submit(url, file_path)
+        if not self.download_manager:
+            future.result()
+            download_manager.wait()
+
+    def get_variant_paths(self, image_path: str) -> typing.Dict[int, str]:
+        """
+        :return: max width -> path of the optimized variants of the image, empty if not enabled.
+        """
+        if not ImageOptimizer.is_enabled() or not ImageUtils.can_optimize(image_path):
+            return {}
+        stem = os.path.splitext(image_path)[0]
+        ext = ImageUtils.get_variant_ext(str(Config.image_format()).lower())
+        return {it: "{}_{}w{}".format(stem, it, ext) for it in ImageOptimizer.get_widths()}
+
+    def get_image_path(self, image_url, image_caption, def_ext='.jpg', block_id=None) -> str:
+        """
+        :param block_id: owning block, its short id is appended so that images with the same name do not collide.
+        """
         prefix = image_url
         if '?' in image_url:
             prefix = image_url[:image_url.find('?')]
@@ -185,7 +281,10 @@ class ImageDownloader:
         if image_caption and len(image_caption) > 0:
             file_name = image_caption + "-" + file_name
         splitext = os.path.splitext(file_name)
-        return slugify(splitext[0], separator='_') + (splitext[1] if splitext[1] else def_ext)
+        file_stem = slugify(splitext[0], separator='_')
+        if block_id:
+            file_stem = "{}_{}".format(file_stem, str(block_id).replace('-', '')[:8])
+        return file_stem + (splitext[1] if splitext[1] else def_ext)
 
 
 # noinspection PyMethodMayBeStatic
@@ -197,6 +296,11 @@ class NotionPageWriter:
         self.draft_dir = "draft"
         self.block_joiner: PageBlockJoiner = PageBlockJoiner()
         self.image_downloader: ImageDownloader = ImageDownloader()
+        # Assets linked by the page being written, see NotionFileOutput
+        self.asset_paths: typing.List[str] = []
+        self.variant_sources: typing.Dict[str, str] = {}
+        # (block, assets dir) -> (text, assets), shared by the writers of the same page, see _render_block
+        self.render_cache: typing.Optional[typing.Dict[typing.Tuple[int, str], typing.Tuple[str, list]]] = None
 
     def is_markdown_able(self, notion_page: NotionPage):
         return notion_page.get_title() is not None  # and notion_page.get_date() is not None
@@ -226,11 +330,15 @@ class NotionPageWriter:
         output.output_dir = self._configure_root_dir()
         output.markdown_path = file_path
         output.properties_path = properties_file_path
+        output.asset_paths = list(self.asset_paths)
+        output.variant_sources = dict(self.variant_sources)
 
         return output
 
     def _start_writing(self, notion_page: NotionPage) -> typing.List[typing.Text]:
         page_lines = []
+        self.asset_paths = []
+        self.variant_sources = {}
         self._write_header(page_lines, notion_page)
         self._write_blocks(page_lines, notion_page.blocks)
         self._write_tail(page_lines, notion_page)
@@ -242,7 +350,12 @@ class NotionPageWriter:
             image_block = PageImageBlock()
             image_block.image_caption = "Page Cover"
             image_block.image_url = notion_page.cover
-            page_lines.append(image_block.write_block())
+            if self.image_downloader.need_download_image(image_block):
+                page_lines.append(self._write_image(
+                    image_block, RenderContext(self._write_curr_block),
+                    notion_page.id, notion_page.cover_version, notion_page.cover_expiry_time, 'cover'))
+            else:
+                page_lines.append(image_block.write_block())
             page_lines.append("")
         pass
 
@@ -268,7 +381,7 @@ class NotionPageWriter:
             page_lines.append("")
 
         # Curr block
-        page_lines.append(self._write_curr_block(block, depth))
+        page_lines.append(self._render_block(block, depth))
 
         # Check suffix-separator
         if self.block_joiner.should_add_separator_after(blocks, curr_idx):
@@ -281,31 +394,49 @@ class NotionPageWriter:
             curr_idx):
         block = blocks[curr_idx]
         if block.type == 'channel_block':
-            if str(block.channel).lower() not in [str(it).lower() for it in Config.channels()]:
+            if str(block.channel).lower() not in [str(it).lower() for it in self.get_channels()]:
                 print("Skip channel block: {}".format(block.channel))
                 return True
         return False
 
-    def _write_curr_block(self, block: PageBaseBlock, depth):
+    def get_channels(self) -> typing.List[str]:
+        return Config.channels()
+
+    def _render_block(self, block: PageBaseBlock, depth):
+        """
+        Render a top level block once per page, the other writers of the page reuse the text
+        and link the same assets into their own dirs.
+        """
+        context = RenderContext(self._write_curr_block, depth)
+        key = (id(block), self.assets_dir)
+        if self.render_cache is not None and key in self.render_cache:
+            text, assets = self.render_cache[key]
+            for asset in assets:
+                self._download_asset(context, *asset)
+            return text
+
+        text = self._write_curr_block(block, context)
+        if self.render_cache is not None:
+            self.render_cache[key] = (text, context.assets)
+        return text
+
+    def _write_curr_block(self, block: PageBaseBlock, context: RenderContext):
+        """
+        Render the block and its children, blocks are never mutated so any number of writers
+        and threads may render the same page at once.
+        """
         if block.is_group():
-            def handler(blocks: typing.List[PageBaseBlock])->str:
-                lines = [self._write_curr_block(it, depth + 1) for it in blocks]
-                return "\n".join(lines)
-            block.on_write_children(handler)
-            return block.write_block()
+            return block.write_block(context)
 
         if self.image_downloader.need_download_image(block):
-            # Download image to assets dir
-            image_path = self.image_downloader.get_image_path(block.image_url, block.image_caption)
-            image_source = self.assets_dir + "/" + image_path
-            block.image_file = FileUtils.new_file(
-                self._configure_root_dir(),
-                image_source
-            )
-            # Check if downloaded before
-            if not FileUtils.exists(block.image_file):
-                self.image_downloader.download_image(block.image_url, block.image_file)
-            return block.write_image_block("/" + image_source)
+            return self._write_image(block, context, block.id, block.image_version, block.image_expiry_time)
+
+        if self.image_downloader.need_download_file(block):
+            def_ext = {'pdf': '.pdf', 'video': '.mp4'}.get(block.type, '')
+            file_path = self.image_downloader.get_image_path(block.file_url, '', def_ext=def_ext, block_id=block.id)
+            self._download_asset(
+                context, file_path, block.file_url, block.id, block.file_version, block.file_expiry_time)
+            return block.write_file_block("/" + self.assets_dir + "/" + file_path)
 
         block_text = block.write_block()
         if block.type in ['text', 'header', 'sub_header', 'sub_sub_header', 'numbered_list', 'bulleted_list', 'quote', 'callout']:
@@ -313,6 +444,38 @@ class NotionPageWriter:
         else:
             return block_text
 
+    def _write_image(
+            self, block: PageImageBlock, context: RenderContext, block_id, version, expiry_time, property_name=None):
+        # Download image to assets dir
+        image_path = self.image_downloader.get_image_path(block.image_url, block.image_caption, block_id=block_id)
+        variant_paths = self.image_downloader.get_variant_paths(image_path)
+        self._download_asset(
+            context, image_path, block.image_url, block_id, version, expiry_time, property_name, variant_paths)
+        # Variants are encoded in the background, the failed ones are dropped afterwards, see drop_failed_variants
+        srcset = [("/" + self.assets_dir + "/" + path, width) for width, path in variant_paths.items()]
+        return block.write_image_block("/" + self.assets_dir + "/" + image_path, srcset)
+
+    def _download_asset(
+            self, context: RenderContext, asset_path, url, block_id, version, expiry_time,
+            property_name=None, variant_paths=None):
+        """
+        Download the asset to asset_path under the assets dir, and record it in the context.
+
+        :return: the file path.
+        """
+        context.assets.append((asset_path, url, block_id, version, expiry_time, property_name, variant_paths))
+        file_path = self._get_asset_file(asset_path)
+        variants = {width: self._get_asset_file(path) for width, path in (variant_paths or {}).items()}
+        self.asset_paths.extend([file_path] + list(variants.values()))
+        for width, path in (variant_paths or {}).items():
+            self.variant_sources[variants[width]] = "/" + self.assets_dir + "/" + path
+        # Assets downloaded before (by any page, channel or run) are linked from the AssetStore
+        self.image_downloader.download_asset(url, file_path, block_id, version, expiry_time, property_name, variants)
+        return file_path
+
+    def _get_asset_file(self, asset_path) -> str:
+        return FileUtils.new_file(self._configure_root_dir(), self.assets_dir + "/" + asset_path)
+
     def _polish_text(self, text):
         if Utils.check_module_installed("pangu"):
             import pangu
@@ -395,6 +558,10 @@ class ChannelWriter(NotionPageWriter):
         self.root_dir = channel
         self.channel = channel
 
+    def get_channels(self) -> typing.List[str]:
+        # The writer of a channel always keeps the blocks of its channel
+        return [self.channel] + [it for it in Config.channels() if str(it).lower() != str(self.channel).lower()]
+
 
 class SpellInspectWriter(NotionPageWriter):
 
@@ -527,6 +694,7 @@ class HexoWriter(NotionPageWriter):
         output = NotionFileOutput()
         output.output_dir = root_dir
         output.markdown_path = file_path
+        output.asset_paths = list(self.asset_paths)
         return output
 
     def _write_header(self, page_lines: typing.List[typing.Text], notion_page: NotionPage):
@@ -0,0 +1,385 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import requests
+
+import notion_assets
+from config import Config
+from notion_assets import DownloadManager, AssetStore, SignedUrl, ImageOptimizer
+from notion_page import NotionPage, PageFileBlock, PageImageBlock
+from notion_writer import NotionPageWriter, NotionWriter
+from utils.image_utils import ImageUtils
+
+
+class FakeResponse:
+
+    def __init__(self, chunks, status_code=200, error_at=None, headers=None):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.error_at = error_at
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError("{} Error".format(self.status_code), response=self)
+
+    def iter_content(self, chunk_size=1):
+        for idx, chunk in enumerate(self.chunks):
+            if idx == self.error_at:
+                raise requests.exceptions.ConnectionError("connection reset")
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class DownloadManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        notion_assets.ASSET_STORE = AssetStore(os.path.join(self.temp_dir.name, 'store'))
+
+    def tearDown(self):
+        notion_assets.ASSET_STORE = None
+        self.temp_dir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir.name, 'assets', name)
+
+    def test_download(self):
+        with DownloadManager(workers=2) as manager:
+            manager.session.get = mock.Mock(return_value=FakeResponse([b'abc', b'def']))
+            self.assertTrue(manager.download('https://example.com/a.png', self._path('a.png')))
+
+        with open(self._path('a.png'), 'rb') as f:
+            self.assertEqual(b'abcdef', f.read())
+
+    def test_download_failures_leave_no_file(self):
+        with DownloadManager(workers=2) as manager:
+            manager.session.get = mock.Mock(side_effect=[
+                FakeResponse([b'abc', b'def'], error_at=1),
+                FakeResponse([b'<Error>AccessDenied</Error>'], status_code=403),
+            ])
+            self.assertFalse(manager.download('https://example.com/a.png', self._path('a.png')))
+            self.assertFalse(manager.download('https://example.com/b.png', self._path('b.png')))
+
+        self.assertEqual([], os.listdir(os.path.dirname(self._path('a.png'))))
+
+    def test_download_max_mb(self):
+        Config.set_download_max_mb(0.001)
+        try:
+            with DownloadManager(workers=1) as manager:
+                manager.session.get = mock.Mock(side_effect=[
+                    FakeResponse([b'a' * 512], headers={'Content-Length': '4096'}),
+                    FakeResponse([b'a' * 512, b'a' * 768]),
+                    FakeResponse([b'a' * 512]),
+                ])
+                self.assertFalse(manager.download('https://example.com/a.mp4', self._path('a.mp4')))
+                self.assertFalse(manager.download('https://example.com/b.mp4', self._path('b.mp4')))
+                self.assertTrue(manager.download('https://example.com/c.mp4', self._path('c.mp4')))
+        finally:
+            Config.set('download_max_mb', 0)
+        self.assertEqual(['c.mp4'], os.listdir(os.path.dirname(self._path('c.mp4'))))
+
+    def test_submit(self):
+        lock = threading.Lock()
+        state = {'in_flight': 0, 'max_in_flight': 0}
+
+        def get(url, **kwargs):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            time.sleep(0.01)
+            with lock:
+                state['in_flight'] -= 1
+            return FakeResponse([url.encode('utf-8')])
+
+        with DownloadManager(workers=3) as manager:
+            manager.session.get = mock.Mock(side_effect=get)
+            for idx in range(12):
+                manager.submit('https://example.com/{}.png'.format(idx), self._path('{}.png'.format(idx)))
+            # Same target file, downloaded once
+            manager.submit('https://example.com/0.png', self._path('0.png'))
+            self.assertEqual(0, manager.wait())
+
+        self.assertEqual(12, manager.session.get.call_count)
+        self.assertEqual(12, len(os.listdir(os.path.dirname(self._path('0.png')))))
+        self.assertLessEqual(state['max_in_flight'], 3)
+        self.assertGreater(state['max_in_flight'], 1)
+
+    def test_asset_store(self):
+        with DownloadManager(workers=2) as manager:
+            manager.session.get = mock.Mock(side_effect=lambda url, **kwargs: FakeResponse([b'logo']))
+            # Same block in two channels, and another block with the same content
+            manager.submit_asset('block-1', 'v1', 'https://example.com/logo.png?sig=1', self._path('hexo/logo.png'))
+            manager.submit_asset('block-1', 'v1', 'https://example.com/logo.png?sig=2', self._path('default/logo.png'))
+            manager.submit_asset('block-2', 'v1', 'https://example.com/copy.png', self._path('default/copy.png'))
+            self.assertEqual(0, manager.wait())
+        self.assertEqual(2, manager.session.get.call_count)
+        self.assertTrue(os.path.samefile(self._path('hexo/logo.png'), self._path('default/logo.png')))
+        self.assertTrue(os.path.samefile(self._path('hexo/logo.png'), self._path('default/copy.png')))
+
+        # Next run: known blocks are linked without any request, changed ones downloaded again
+        notion_assets.ASSET_STORE = AssetStore(os.path.join(self.temp_dir.name, 'store'))
+        notion_assets.ASSET_STORE.load()
+        with DownloadManager(workers=2) as manager:
+            manager.session.get = mock.Mock(side_effect=lambda url, **kwargs: FakeResponse([b'new logo']))
+            manager.submit_asset('block-1', 'v1', 'https://example.com/logo.png?sig=3', self._path('next/logo.png'))
+            manager.submit_asset('block-2', 'v2', 'https://example.com/copy.png', self._path('next/copy.png'))
+            self.assertEqual(0, manager.wait())
+        self.assertEqual(1, manager.session.get.call_count)
+        with open(self._path('next/logo.png'), 'rb') as f:
+            self.assertEqual(b'logo', f.read())
+        with open(self._path('next/copy.png'), 'rb') as f:
+            self.assertEqual(b'new logo', f.read())
+
+    def test_variants(self):
+        encoded = Future()
+        optimizer = mock.Mock()
+        optimizer.submit.return_value = encoded
+        with DownloadManager(workers=1) as manager:
+            manager.image_optimizer = optimizer
+            manager.session.get = mock.Mock(return_value=FakeResponse([b'image']))
+            variants = {640: self._path('a_640w.webp'), 1280: self._path('a_1280w.webp')}
+            manager.submit_asset('block-1', 'v1', 'https://example.com/a.png', self._path('a.png'), variants=variants)
+            blob_path = manager.asset_futures[('block-1', 'v1')].result()
+            # 1280 is not encoded and skipped
+            variant_blob = os.path.join(self.temp_dir.name, 'variant.webp')
+            with open(variant_blob, 'wb') as f:
+                f.write(b'webp')
+            encoded.set_result({640: variant_blob})
+            self.assertEqual(0, manager.wait())
+            manager.image_optimizer = None
+
+        optimizer.submit.assert_called_once_with(blob_path, [640, 1280])
+        self.assertTrue(os.path.samefile(variant_blob, self._path('a_640w.webp')))
+        self.assertFalse(os.path.exists(self._path('a_1280w.webp')))
+        self.assertTrue(manager.get_variant_future(self._path('a_640w.webp')).result())
+        self.assertFalse(manager.get_variant_future(self._path('a_1280w.webp')).result())
+
+    def test_shared_instance_saved_on_exit(self):
+        with mock.patch('notion_assets.atexit.register') as register, \
+                mock.patch('notion_assets.DOWNLOAD_MANAGER', None):
+            manager = DownloadManager.get_instance()
+            manager.session.get = mock.Mock(return_value=FakeResponse([b'logo']))
+            manager.submit_asset('block-1', 'v1', 'https://example.com/logo.png', self._path('logo.png')).result()
+            register.assert_called_once_with(manager.close)
+            register.call_args[0][0]()
+
+        store = AssetStore(os.path.join(self.temp_dir.name, 'store'))
+        store.load()
+        self.assertIsNotNone(store.lookup('block-1', 'v1'))
+
+    def test_soonest_expiry_first(self):
+        started = threading.Event()
+        release = threading.Event()
+        urls = []
+
+        def get(url, **kwargs):
+            urls.append(url)
+            if url.endswith('blocker.png'):
+                started.set()
+                release.wait(5)
+            return FakeResponse([url.encode('utf-8')])
+
+        now = time.time()
+        with DownloadManager(workers=1) as manager:
+            manager.session.get = mock.Mock(side_effect=get)
+            manager.submit('https://example.com/blocker.png', self._path('blocker.png'))
+            started.wait(5)
+            # At most workers * 4 tasks may be queued, the rest would wait for a slot
+            manager.submit('https://example.com/external.png', self._path('external.png'))
+            for name, expires_in in [('late', 3000), ('soon', 600)]:
+                manager.submit_asset(
+                    name, 'v1', 'https://s3.example.com/{}.png'.format(name), self._path(name + '.png'),
+                    expiry_time=time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(now + expires_in)))
+            release.set()
+            self.assertEqual(0, manager.wait())
+
+        self.assertEqual([
+            'https://example.com/blocker.png',
+            'https://s3.example.com/soon.png',
+            'https://s3.example.com/late.png',
+            'https://example.com/external.png',
+        ], urls)
+
+    def test_store_failures_leave_no_temp_file(self):
+        store = notion_assets.ASSET_STORE
+        with DownloadManager(workers=1) as manager, \
+                mock.patch.object(store, 'put_file', side_effect=OSError("disk full")):
+            manager.session.get = mock.Mock(return_value=FakeResponse([b'image']))
+            manager.submit_asset('block-1', 'v1', 'https://example.com/a.png', self._path('a.png'))
+            self.assertEqual(1, manager.wait())
+        self.assertEqual([], os.listdir(os.path.join(store.store_dir, 'tmp')))
+
+    def test_expired_url_refreshed(self):
+        def get(url, **kwargs):
+            if 'sig=old' in url:
+                return FakeResponse([b'<Error>Request has expired</Error>'], status_code=403)
+            return FakeResponse([b'image'])
+
+        client = mock.Mock()
+        client.blocks.retrieve.return_value = {
+            'type': 'image', 'image': {'type': 'file', 'file': {'url': 'https://s3.example.com/a.png?sig=new'}}}
+        with mock.patch('notion_assets.NotionTransport.get_client', return_value=client):
+            with DownloadManager(workers=1) as manager:
+                manager.session.get = mock.Mock(side_effect=get)
+                manager.submit_asset('block-1', 'v1', 'https://s3.example.com/a.png?sig=old', self._path('a.png'))
+                self.assertEqual(0, manager.wait())
+
+        client.blocks.retrieve.assert_called_once_with(block_id='block-1')
+        self.assertEqual(2, manager.session.get.call_count)
+        with open(self._path('a.png'), 'rb') as f:
+            self.assertEqual(b'image', f.read())
+
+
+class AssetWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        Config.set_output(tempfile.mkdtemp())
+        self.writer = NotionPageWriter()
+        self.writer.image_downloader.download_manager = mock.Mock()
+
+    def tearDown(self):
+        Config.set('download_image', False)
+        Config.set('download_assets', False)
+        Config.set('optimize_images', False)
+
+    def _file_block(self, block_type, source):
+        block = PageFileBlock()
+        block.id = 'a1b2c3d4-0000-0000-0000-000000000000'
+        block.type = block_type
+        block.file_url = 'https://s3.example.com/x/Report.pdf?X-Amz-Expires=3600'
+        block.file_source = source
+        block.file_version = 'v1'
+        return block
+
+    def test_files(self):
+        block = self._file_block('pdf', 'file')
+        self.assertEqual('[File]({})'.format(block.file_url), self.writer._render_block(block, 0))
+
+        Config.set_download_assets(True)
+        self.assertEqual('[File](/assets/report_a1b2c3d4.pdf)', self.writer._render_block(block, 0))
+        manager = self.writer.image_downloader.download_manager
+        self.assertEqual(1, manager.submit_asset.call_count)
+        self.assertEqual((block.id, 'v1', block.file_url), manager.submit_asset.call_args[0][:3])
+
+        # Links to other hosts are kept
+        video = self._file_block('video', 'external')
+        video.file_url = 'https://www.youtube.com/watch?v=abc'
+        self.assertEqual('Video: <https://www.youtube.com/watch?v=abc>', self.writer._render_block(video, 0))
+        self.assertEqual(1, manager.submit_asset.call_count)
+
+    def test_cover(self):
+        notion_page = NotionPage()
+        notion_page.id = 'a1b2c3d4-0000-0000-0000-000000000000'
+        notion_page.cover = 'https://s3.example.com/x/cover.png?X-Amz-Expires=3600'
+        notion_page.cover_version = 'https://s3.example.com/x/cover.png'
+        Config.set_download_image(True)
+
+        page_lines = []
+        self.writer._write_header(page_lines, notion_page)
+        self.assertIn('![Page Cover](/assets/page_cover_cover_a1b2c3d4.png)', page_lines)
+        args = self.writer.image_downloader.download_manager.submit_asset.call_args[0]
+        self.assertEqual((notion_page.id, notion_page.cover_version), args[:2])
+        self.assertEqual('cover', args[5])
+
+    def test_srcset(self):
+        block = PageImageBlock()
+        block.id = 'a1b2c3d4-0000-0000-0000-000000000000'
+        block.image_caption = 'Diagram'
+        block.image_url = 'https://s3.example.com/x/image.png?X-Amz-Expires=3600'
+        notion_page = NotionPage()
+        notion_page.id = 'page-1'
+        notion_page.properties = {'Title': 'Hello', 'FileName': 'hello'}
+        notion_page.blocks = [block]
+        Config.set_download_image(True)
+        Config.set_optimize_images(True)
+
+        # Rendering never waits for the variants to be encoded
+        encoded = {}
+        manager = self.writer.image_downloader.download_manager
+        manager.get_variant_future.side_effect = lambda path: encoded.setdefault(path, Future())
+        with mock.patch('notion_writer.ImageOptimizer.is_enabled', return_value=True):
+            output = self.writer.write_page(notion_page)
+        with open(output.markdown_path, encoding='utf-8') as f:
+            self.assertIn(
+                '<img src="/assets/diagram_image_a1b2c3d4.png" srcset="/assets/diagram_image_a1b2c3d4_640w.webp 640w, '
+                '/assets/diagram_image_a1b2c3d4_1280w.webp 1280w" alt="Diagram" loading="lazy">', f.read())
+        manager.get_variant_future.assert_not_called()
+        variants = manager.submit_asset.call_args[0][6]
+        self.assertEqual([640, 1280], list(variants.keys()))
+        self.assertTrue(variants[640].endswith(os.path.join('assets', 'diagram_image_a1b2c3d4_640w.webp')))
+
+        # Variants that could not be encoded are dropped once the downloads are done
+        for variant_path, future in [(it, manager.get_variant_future(it)) for it in variants.values()]:
+            future.set_result('640w' in variant_path)
+        NotionWriter.drop_failed_variants(output, manager)
+        with open(output.markdown_path, encoding='utf-8') as f:
+            self.assertIn(
+                '<img src="/assets/diagram_image_a1b2c3d4.png" srcset="/assets/diagram_image_a1b2c3d4_640w.webp 640w" '
+                'alt="Diagram" loading="lazy">', f.read())
+
+
+@unittest.skipUnless(ImageUtils.is_supported(), "Pillow not installed")
+class ImageOptimizerTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_submit(self):
+        from PIL import Image
+        blob_path = os.path.join(self.temp_dir.name, 'blobs', 'ab', 'abcdef.png')
+        os.makedirs(os.path.dirname(blob_path))
+        Image.new('RGB', (1000, 500), (255, 0, 0)).save(blob_path)
+
+        optimizer = ImageOptimizer(AssetStore(self.temp_dir.name), workers=1)
+        try:
+            variants = optimizer.submit(blob_path, [640, 1280]).result()
+            with Image.open(variants[640]) as image:
+                self.assertEqual((640, 320), image.size)
+            with Image.open(variants[1280]) as image:
+                self.assertEqual((1000, 500), image.size)
+
+            # Cached by content hash
+            optimizer.futures.clear()
+            with mock.patch.object(optimizer.executor, 'submit') as submit:
+                self.assertEqual(variants, optimizer.submit(blob_path, [640, 1280]).result())
+                submit.assert_not_called()
+        finally:
+            optimizer.close()
+
+
+class SignedUrlTest(unittest.TestCase):
+
+    def test_get_expiry(self):
+        url = 'https://prod-files-secure.s3.us-west-2.amazonaws.com/a/b/image.png' \
+              '?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Date=20240101T000000Z&X-Amz-Expires=3600&X-Amz-Signature=abc'
+        self.assertEqual(1704067200 + 3600, SignedUrl.get_expiry(url))
+        self.assertEqual(1704067200 + 3600, SignedUrl.get_expiry(url, '2024-01-01T01:00:00.000Z'))
+        self.assertIsNone(SignedUrl.get_expiry('https://example.com/image.png'))
+
+    def test_refresh_cover(self):
+        client = mock.Mock()
+        client.pages.retrieve.return_value = {'cover': {'type': 'file', 'file': {'url': 'https://s3.example.com/c.png'}}}
+        with mock.patch('notion_assets.NotionTransport.get_client', return_value=client):
+            self.assertEqual('https://s3.example.com/c.png', SignedUrl.refresh('page-1', 'cover'))
+        client.pages.retrieve.assert_called_once_with(page_id='page-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from config import Config
+from notion_cache import NotionApiCache
+
+
+class NotionApiCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = NotionApiCache(os.path.join(self.temp_dir.name, "cache.sqlite"), 1024)
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def test_version_match(self):
+        self.cache.put('blocks.children', 'block', '2021-05-20T00:00:00.000Z', [{'id': 'child'}])
+        self.assertEqual([{'id': 'child'}], self.cache.get('blocks.children', 'block', '2021-05-20T00:00:00.000Z'))
+        self.assertIsNone(self.cache.get('blocks.children', 'block', '2021-05-21T00:00:00.000Z'))
+        self.assertIsNone(self.cache.get('pages.retrieve', 'block', '2021-05-20T00:00:00.000Z'))
+
+    def test_lru_eviction(self):
+        value = 'x' * 300
+        self.cache.put('ns', 'a', 'v', value)
+        self.cache.put('ns', 'b', 'v', value)
+        self.cache.put('ns', 'c', 'v', value)
+        # touch 'a' so that 'b' is the least recently used
+        self.assertEqual(value, self.cache.get('ns', 'a', 'v'))
+        self.cache.put('ns', 'd', 'v', value)
+
+        self.assertIsNone(self.cache.get('ns', 'b', 'v'))
+        self.assertEqual(value, self.cache.get('ns', 'a', 'v'))
+        self.assertEqual(value, self.cache.get('ns', 'd', 'v'))
+        self.assertLessEqual(self.cache.total_bytes, 1024)
+
+    def test_cached_loader(self):
+        loader = mock.Mock(return_value={'id': 'page'})
+        with mock.patch.object(NotionApiCache, 'get_instance', return_value=self.cache):
+            self.assertEqual({'id': 'page'}, NotionApiCache.cached('pages.retrieve', 'page', 'v1', loader))
+            self.assertEqual({'id': 'page'}, NotionApiCache.cached('pages.retrieve', 'page', 'v1', loader))
+            self.assertEqual(1, loader.call_count)
+            # no version, never cached
+            NotionApiCache.cached('pages.retrieve', 'page', None, loader)
+            self.assertEqual(2, loader.call_count)
+
+    def test_expired_signed_urls(self):
+        def image_block(expiry_time):
+            return [{'id': 'image', 'type': 'image', 'image': {
+                'type': 'file', 'file': {'url': 'https://s3.example.com/a.png', 'expiry_time': expiry_time}}}]
+
+        loader = mock.Mock(side_effect=[image_block('2021-05-20T01:00:00.000Z'), image_block('2999-01-01T00:00:00.000Z')])
+        with mock.patch.object(NotionApiCache, 'get_instance', return_value=self.cache):
+            NotionApiCache.cached('blocks.children', 'page', 'v1', loader)
+            # The cached signed url expired, the listing is loaded again
+            value = NotionApiCache.cached('blocks.children', 'page', 'v1', loader)
+            self.assertEqual('2999-01-01T00:00:00.000Z', value[0]['image']['file']['expiry_time'])
+            self.assertEqual(value, NotionApiCache.cached('blocks.children', 'page', 'v1', loader))
+            self.assertEqual(2, loader.call_count)
+
+    def test_no_cache(self):
+        Config.set('no_cache', True)
+        try:
+            self.assertIsNone(NotionApiCache.get_instance())
+        finally:
+            Config.set('no_cache', False)
+
+
+if __name__ == '__main__':
+    unittest.main()
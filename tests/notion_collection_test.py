@@ -0,0 +1,207 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import notion_page
+from config import Config
+from notion_cache import RunMemo
+from notion_page import NotionPage, PageTableBlock
+from utils.database_utils import DatabaseColumnOrderingUtils
+
+
+def _row(index):
+    return {
+        'id': 'row-{}'.format(index),
+        'properties': {
+            'Name': {'type': 'title', 'title': [{'plain_text': 'Row {}'.format(index), 'annotations': {}}]},
+            'Order': {'type': 'number', 'number': index},
+        },
+    }
+
+
+SCHEMA = {'Name': {'id': 'title', 'type': 'title'}, 'Order': {'id': 'ord', 'type': 'number'}}
+
+
+class FakeQuery:
+    """Serve database rows page by page, like /v1/databases/{id}/query."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.bodies = []
+        self.params = []
+
+    def __call__(self, url, headers=None, json=None, params=None):
+        self.bodies.append(json)
+        self.params.append(params)
+        start = int(json.get('start_cursor') or 0)
+        end = start + json.get('page_size', 100)
+        response = mock.Mock()
+        response.json.return_value = {
+            'results': self.rows[start:end],
+            'has_more': end < len(self.rows),
+            'next_cursor': str(end) if end < len(self.rows) else None,
+        }
+        return response
+
+
+class NotionCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        Config.set_no_cache(True)
+        notion_page.DATABASE_MEMO.clear()
+
+    def tearDown(self):
+        Config.set_no_cache(False)
+        Config.set_database_row_limit(0)
+
+    def _parse_collection(self, rows, description='', properties=SCHEMA, times=1):
+        database = {
+            'id': 'db',
+            'properties': properties or {},
+            'description': [{'plain_text': description}] if description else [],
+        }
+        client = mock.Mock()
+        client.databases.retrieve.return_value = database
+        query = FakeQuery(rows)
+        http_client = mock.Mock()
+        http_client.post.side_effect = query
+
+        page_blocks = []
+        with mock.patch('notion_reader.NotionReader.get_client', return_value=client), \
+                mock.patch('notion_page.NotionTransport.get_http_client', return_value=http_client):
+            for _ in range(times):
+                NotionPage()._parse_collection(page_blocks, {'id': 'db', 'type': 'child_database'})
+        self.assertEqual(times, len(page_blocks))
+        self.assertIsInstance(page_blocks[0], PageTableBlock)
+        self.client = client
+        return page_blocks[0], query
+
+    def test_paginated_query(self):
+        table, query = self._parse_collection([_row(it) for it in range(250)])
+        self.assertEqual(['Name', 'Order'], table.headers)
+        self.assertEqual(250, len(table.rows))
+        self.assertEqual(['Row 249', '249'], table.rows[-1])
+        self.assertEqual([None, '100', '200'], [it.get('start_cursor') for it in query.bodies])
+
+    def test_row_limit(self):
+        table, query = self._parse_collection([_row(it) for it in range(250)], 'row-limit: 120')
+        self.assertEqual(120, len(table.rows))
+        self.assertEqual([100, 20], [it.get('page_size') for it in query.bodies])
+
+        notion_page.DATABASE_MEMO.clear()
+        Config.set_database_row_limit(5)
+        table, query = self._parse_collection([_row(it) for it in range(250)])
+        self.assertEqual(5, len(table.rows))
+        self.assertEqual(1, len(query.bodies))
+
+    def test_row_filter_pushdown(self):
+        schema = dict(SCHEMA, Secret={'id': 'sec', 'type': 'rich_text'})
+        table, query = self._parse_collection(
+            [_row(it) for it in range(3)],
+            'property-order: Secret=-1\nrow-filter: Order >= 1, Name != "Row 2"',
+            schema)
+        self.assertEqual({'and': [
+            {'property': 'Order', 'number': {'greater_than_or_equal_to': 1}},
+            {'property': 'Name', 'title': {'does_not_equal': 'Row 2'}},
+        ]}, query.bodies[0]['filter'])
+        self.assertEqual({'filter_properties': ['title', 'ord']}, query.params[0])
+        self.assertEqual(['Name', 'Order'], table.headers)
+
+    def test_row_filter_local(self):
+        # Inline databases come without schema, the rows are filtered locally
+        table, query = self._parse_collection([_row(it) for it in range(10)], 'row-filter: Order > 6\nrow-limit: 2', {})
+        self.assertNotIn('filter', query.bodies[-1])
+        self.assertEqual([['Row 7', '7'], ['Row 8', '8']], table.rows)
+
+    def test_parse_row_filter(self):
+        self.assertEqual([
+            {'property': 'Due Date', 'operator': '>=', 'value': '2021-01-01'},
+            {'property': 'Tags', 'operator': 'not contains', 'value': 'Draft'},
+            {'property': 'Published', 'operator': '=', 'value': 'true'},
+        ], DatabaseColumnOrderingUtils.parse_row_filter(
+            "Intro\nrow-filter: Due Date >= 2021-01-01, Tags not contains 'Draft', Published = true\nMore"))
+        self.assertIsNone(DatabaseColumnOrderingUtils.parse_row_filter("No configuration here"))
+        # Commas inside quoted or escaped values do not split conditions
+        self.assertEqual([
+            {'property': 'Tags', 'operator': 'contains', 'value': 'a, b'},
+            {'property': 'Title', 'operator': '=', 'value': "Hello, 'world'"},
+            {'property': 'Name', 'operator': '!=', 'value': 'Doe, John'},
+        ], DatabaseColumnOrderingUtils.parse_row_filter(
+            'row-filter: Tags contains "a, b", Title = "Hello, \'world\'", Name != Doe\\, John'))
+
+        query_filter, local_conditions = DatabaseColumnOrderingUtils.build_query_filter(
+            DatabaseColumnOrderingUtils.parse_row_filter("row-filter: Published = true, Status > 1, Missing = 1"),
+            {'Published': {'type': 'checkbox'}, 'Status': {'type': 'select'}})
+        self.assertEqual({'property': 'Published', 'checkbox': {'equals': True}}, query_filter)
+        self.assertEqual(['Status', 'Missing'], [it['property'] for it in local_conditions])
+
+    def test_memo_across_pages(self):
+        table, query = self._parse_collection([_row(it) for it in range(150)], properties={}, times=3)
+        self.assertEqual(150, len(table.rows))
+        self.assertEqual(1, self.client.databases.retrieve.call_count)
+        # First page with the default sort, then two pages sorted by 'Order', for all three pages
+        self.assertEqual(3, len(query.bodies))
+        self.assertEqual([{'property': 'Order', 'direction': 'ascending'}], query.bodies[-1]['sorts'])
+
+    def test_not_persisted_across_runs(self):
+        # A persistent cache holding a stale database and stale rows is never consulted
+        stale_cache = mock.Mock()
+        stale_cache.get.return_value = {'properties': {}, 'results': [], 'has_more': False}
+        with mock.patch('notion_cache.NotionApiCache.get_instance', return_value=stale_cache):
+            self._parse_collection([_row(0)])
+            notion_page.DATABASE_MEMO.clear()
+            table, query = self._parse_collection([_row(0), _row(1)])
+        self.assertEqual(2, len(table.rows))
+        self.assertEqual(1, self.client.databases.retrieve.call_count)
+        stale_cache.get.assert_not_called()
+
+    def test_infer_schema_without_pre_query(self):
+        # All rows in the first page: sorted locally by the inferred 'Order' column
+        rows = [_row(it) for it in [3, 1, 2]]
+        rows.append({'id': 'empty', 'properties': {
+            'Name': {'type': 'title', 'title': [{'plain_text': 'Empty', 'annotations': {}}]},
+            'Order': {'type': 'number', 'number': None},
+        }})
+        table, query = self._parse_collection(rows, properties={})
+        self.assertEqual(['Row 1', 'Row 2', 'Row 3', 'Empty'], [it[0] for it in table.rows])
+        self.assertEqual(1, len(query.bodies))
+        self.assertEqual(['Name', 'Order'], list(notion_page.DATABASE_MEMO.get(('schema', 'db')).keys()))
+
+        # No order column: the default sort is kept
+        notion_page.DATABASE_MEMO.clear()
+        rows = [{'id': str(it), 'properties': {'Name': {'type': 'title', 'title': [
+            {'plain_text': str(it), 'annotations': {}}]}}} for it in range(150)]
+        table, query = self._parse_collection(rows, properties={})
+        self.assertEqual(150, len(table.rows))
+        self.assertEqual(2, len(query.bodies))
+
+    def test_run_memo_concurrent(self):
+        memo = RunMemo()
+        lock = threading.Lock()
+        calls = []
+
+        def loader():
+            with lock:
+                calls.append(1)
+            threading.Event().wait(0.05)
+            return 'value'
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            values = list(executor.map(lambda _: memo.get_or_load('key', loader), range(8)))
+        self.assertEqual(['value'] * 8, values)
+        self.assertEqual(1, len(calls))
+
+        # Failures are not memoized
+        self.assertRaises(ValueError, memo.get_or_load, 'broken', mock.Mock(side_effect=ValueError))
+        self.assertEqual('fixed', memo.get_or_load('broken', lambda: 'fixed'))
+
+    def test_parse_row_limit(self):
+        self.assertEqual(30, DatabaseColumnOrderingUtils.parse_row_limit("Intro\nrow-limit: 30\nMore"))
+        self.assertIsNone(DatabaseColumnOrderingUtils.parse_row_limit("row-limit: 0"))
+        self.assertIsNone(DatabaseColumnOrderingUtils.parse_row_limit("No configuration here"))
+
+
+if __name__ == '__main__':
+    unittest.main()
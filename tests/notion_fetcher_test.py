@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from config import Config
+from notion_fetcher import NotionBlockFetcher
+
+
+def _block(block_id, has_children=False, block_type='paragraph', **kwargs):
+    block = {'id': block_id, 'type': block_type, 'has_children': has_children}
+    block.update(kwargs)
+    return block
+
+
+TREE = {
+    'root': [
+        _block('a', True),
+        _block('b', True, 'column_list'),
+        _block('sub', True, 'child_page'),
+        _block('copy', False, 'synced_block', synced_block={'synced_from': {'block_id': 'source'}}),
+    ],
+    'a': [_block('a1', True), _block('a2')],
+    'b': [_block('b1', True, 'column'), _block('b2', True, 'column')],
+    'a1': [_block('a11')],
+    'b1': [_block('b11')],
+    'b2': [_block('b21')],
+    'source': [_block('s1')],
+}
+
+
+class NotionBlockFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+
+    def test_fetch_tree(self):
+        with mock.patch.object(NotionBlockFetcher, 'list_children', side_effect=lambda it, version=None: TREE[it]) as list_children:
+            children_map = NotionBlockFetcher(concurrency=4).fetch_tree('root')
+
+        self.assertEqual(set(TREE.keys()), set(children_map.keys()))
+        self.assertEqual(TREE['b'], children_map['b'])
+        self.assertNotIn('sub', children_map)
+        self.assertEqual(len(TREE), list_children.call_count)
+
+    def test_fetch_tree_bounded_concurrency(self):
+        lock = threading.Lock()
+        state = {'in_flight': 0, 'max_in_flight': 0}
+        wide_tree = {'root': [_block(str(it), True) for it in range(20)]}
+
+        def list_children(block_id, version=None):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            time.sleep(0.01)
+            with lock:
+                state['in_flight'] -= 1
+            return wide_tree.get(block_id, [])
+
+        with mock.patch.object(NotionBlockFetcher, 'list_children', side_effect=list_children):
+            children_map = NotionBlockFetcher(concurrency=3).fetch_tree('root')
+
+        self.assertEqual(21, len(children_map))
+        self.assertLessEqual(state['max_in_flight'], 3)
+        self.assertGreater(state['max_in_flight'], 1)
+
+    def test_fetch_tree_skip_failures(self):
+        def list_children(block_id, version=None):
+            if block_id == 'a':
+                raise Exception('boom')
+            return TREE[block_id]
+
+        with mock.patch.object(NotionBlockFetcher, 'list_children', side_effect=list_children):
+            children_map = NotionBlockFetcher(concurrency=2).fetch_tree('root')
+
+        self.assertNotIn('a', children_map)
+        self.assertNotIn('a1', children_map)
+        self.assertIn('b21', [it['id'] for it in children_map['b2']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from config import Config
+from notion_index import NotionPageIndex, UNRESOLVED
+
+
+def _page(page_id, last_edited_time, **kwargs):
+    page = {'id': page_id, 'object': 'page', 'last_edited_time': last_edited_time}
+    page.update(kwargs)
+    return page
+
+
+class FakeSearch:
+
+    def __init__(self, pages, page_size=2):
+        self.pages = sorted(pages, key=lambda it: it['last_edited_time'], reverse=True)
+        self.page_size = page_size
+        self.calls = 0
+
+    def __call__(self, start_cursor=None, **kwargs):
+        self.calls += 1
+        start = int(start_cursor or 0)
+        end = start + self.page_size
+        return {
+            'results': self.pages[start:end],
+            'has_more': end < len(self.pages),
+            'next_cursor': str(end) if end < len(self.pages) else None,
+        }
+
+
+class NotionPageIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.temp_dir.name, "page_index.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _refresh(self, pages):
+        search = FakeSearch(pages)
+        client = mock.Mock()
+        client.search.side_effect = search
+        with mock.patch('notion_index.NotionTransport.get_client', return_value=client):
+            index = NotionPageIndex(self.index_path)
+            index.load()
+            result = index.get_pages()
+        return index, result, search
+
+    def test_delta_refresh(self):
+        pages = [_page(str(it), '2021-05-{:02d}T00:00:00.000Z'.format(it + 1)) for it in range(10)]
+        index, result, search = self._refresh(pages)
+        self.assertEqual(10, len(result))
+        self.assertEqual(5, search.calls)
+        self.assertEqual('2021-05-10T00:00:00.000Z', index.watermark)
+
+        # One page edited, one page added, one page trashed
+        pages[0] = _page('0', '2021-06-01T00:00:00.000Z')
+        pages[1] = _page('1', '2021-06-02T00:00:00.000Z', in_trash=True)
+        pages.append(_page('new', '2021-06-03T00:00:00.000Z'))
+        index, result, search = self._refresh(pages)
+
+        self.assertEqual(3, search.calls)
+        self.assertEqual(['new', '0', '9'], [it['id'] for it in result[:3]])
+        self.assertNotIn('1', index.pages)
+        self.assertEqual(10, len(result))
+        self.assertEqual('2021-06-03T00:00:00.000Z', index.watermark)
+
+    def test_full_scan(self):
+        pages = [_page(str(it), '2021-05-{:02d}T00:00:00.000Z'.format(it + 1)) for it in range(4)]
+        self._refresh(pages)
+
+        # Un-shared pages never show up in a delta
+        unshared = pages[:3]
+        index, result, search = self._refresh(unshared)
+        self.assertEqual(4, len(result))
+
+        Config.set_full_index(True)
+        try:
+            index, result, search = self._refresh(unshared)
+        finally:
+            Config.set('full_index', False)
+        self.assertEqual(['2', '1', '0'], [it['id'] for it in result])
+
+        # Stale indexes are scanned in full as well
+        index, result, search = self._refresh(pages[:2])
+        self.assertEqual(3, len(result))
+        index.full_scan_at -= 8 * 24 * 3600
+        index.save()
+        index, result, search = self._refresh(pages[:2])
+        self.assertEqual(['1', '0'], [it['id'] for it in result])
+
+    def test_descendants(self):
+        root = '00000000-0000-0000-0000-000000000000'
+        pages = [
+            _page('11111111-1111-1111-1111-111111111111', '2021-05-01T00:00:00.000Z',
+                  parent={'type': 'page_id', 'page_id': root}),
+            # Row of a database under the root page
+            _page('22222222-2222-2222-2222-222222222222', '2021-05-02T00:00:00.000Z',
+                  parent={'type': 'database_id', 'database_id': 'dddddddd-dddd-dddd-dddd-dddddddddddd'}),
+            # Page within a column block of the first page
+            _page('33333333-3333-3333-3333-333333333333', '2021-05-03T00:00:00.000Z',
+                  parent={'type': 'block_id', 'block_id': 'bbbbbbbb-bbbb-bbbb-bbbb-bbbbbbbbbbbb'}),
+            _page('44444444-4444-4444-4444-444444444444', '2021-05-04T00:00:00.000Z',
+                  parent={'type': 'workspace', 'workspace': True}),
+        ]
+        client = mock.Mock()
+        client.search.side_effect = FakeSearch(pages)
+        client.databases.retrieve.side_effect = lambda database_id: {
+            'parent': {'type': 'page_id', 'page_id': root}}
+        client.blocks.retrieve.side_effect = lambda block_id: {
+            'parent': {'type': 'block_id', 'block_id': 'cccccccccccccccccccccccccccccccc'}} \
+            if block_id == 'bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb' else {
+            'parent': {'type': 'page_id', 'page_id': '11111111-1111-1111-1111-111111111111'}}
+
+        with mock.patch('notion_index.NotionTransport.get_client', return_value=client):
+            index = NotionPageIndex(self.index_path)
+            descendants = index.get_descendants(root)
+            recent = index.get_descendants(root, edited_since='2021-05-02T00:00:00.000Z')
+
+        self.assertEqual(['1111', '2222', '3333'], sorted([it['id'][:4] for it in descendants]))
+        self.assertEqual(['2222', '3333'], sorted([it['id'][:4] for it in recent]))
+        self.assertEqual(2, client.blocks.retrieve.call_count)
+
+        # Parent nodes are persisted, no more lookups
+        client.reset_mock()
+        with mock.patch('notion_index.NotionTransport.get_client', return_value=client):
+            index = NotionPageIndex(self.index_path)
+            index.load()
+            self.assertEqual(3, len(index.get_descendants(root)))
+        client.blocks.retrieve.assert_not_called()
+        client.databases.retrieve.assert_not_called()
+
+    def test_transient_parent_failures(self):
+        root = '00000000-0000-0000-0000-000000000000'
+        pages = [
+            _page('22222222-2222-2222-2222-222222222222', '2021-05-02T00:00:00.000Z',
+                  parent={'type': 'database_id', 'database_id': 'dddddddd-dddd-dddd-dddd-dddddddddddd'}),
+            _page('33333333-3333-3333-3333-333333333333', '2021-05-03T00:00:00.000Z',
+                  parent={'type': 'block_id', 'block_id': 'bbbbbbbb-bbbb-bbbb-bbbb-bbbbbbbbbbbb'}),
+        ]
+
+        def error(status):
+            e = Exception("{} Error".format(status))
+            e.status = status
+            return e
+
+        client = mock.Mock()
+        client.search.side_effect = FakeSearch(pages)
+        client.databases.retrieve.side_effect = error(503)
+        client.blocks.retrieve.side_effect = error(404)
+        with mock.patch('notion_index.NotionTransport.get_client', return_value=client):
+            index = NotionPageIndex(self.index_path)
+            self.assertEqual([], index.get_descendants(root))
+        # Only the definitive 404 is recorded
+        self.assertEqual({'bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb': None}, index.nodes)
+
+        # Resolved on the next run
+        client.databases.retrieve.side_effect = lambda database_id: {'parent': {'type': 'page_id', 'page_id': root}}
+        with mock.patch('notion_index.NotionTransport.get_client', return_value=client):
+            index = NotionPageIndex(self.index_path)
+            index.load()
+            self.assertEqual(['2222'], [it['id'][:4] for it in index.get_descendants(root)])
+        self.assertEqual(1, client.blocks.retrieve.call_count)
+
+    def test_concurrent_resolve_parent(self):
+        index = NotionPageIndex(self.index_path)
+        retrieved = threading.Barrier(4, timeout=5)
+
+        def retrieve_parent(node):
+            retrieved.wait()
+            return UNRESOLVED if node[1] == 'failed' else ('page_id', 'root')
+
+        nodes = [('block_id', 'block'), ('block_id', 'block'), ('database_id', 'failed'), ('block_id', 'block')]
+        with mock.patch.object(NotionPageIndex, 'retrieve_parent', side_effect=retrieve_parent):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                parents = list(executor.map(index.resolve_parent, nodes))
+        self.assertEqual([('page_id', 'root'), ('page_id', 'root'), None, ('page_id', 'root')], parents)
+        # Transient failures are never recorded
+        self.assertEqual({'block': ('page_id', 'root')}, index.nodes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from config import Config
+from notion_manifest import NotionManifest
+from utils.utils import FileUtils
+
+
+class NotionManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        Config.set_output(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_output(self, name):
+        path = os.path.join(self.temp_dir.name, name)
+        FileUtils.create_file(path)
+        return path
+
+    def test_changed_and_removed_pages(self):
+        manifest = NotionManifest.load()
+        page_a = {'id': 'a', 'last_edited_time': '2021-05-20T00:00:00.000Z'}
+        page_b = {'id': 'b', 'last_edited_time': '2021-05-20T00:00:00.000Z'}
+        self.assertTrue(manifest.is_changed(page_a))
+
+        output_b = self._write_output('b.md')
+        manifest.put('a', page_a['last_edited_time'], [self._write_output('a.md')])
+        manifest.put('b', page_b['last_edited_time'], [output_b])
+        manifest.save()
+
+        manifest = NotionManifest.load()
+        self.assertFalse(manifest.is_changed(page_a))
+        self.assertTrue(manifest.is_changed({'id': 'a', 'last_edited_time': '2021-05-21T00:00:00.000Z'}))
+        self.assertEqual(['b'], manifest.get_removed_ids([page_a]))
+
+        manifest.remove('b')
+        self.assertFalse(FileUtils.exists(output_b))
+        self.assertNotIn('b', manifest.pages)
+
+    def test_reset_on_config_changes(self):
+        manifest = NotionManifest.load()
+        manifest.put('a', '2021-05-20T00:00:00.000Z', [])
+        manifest.save()
+
+        self.assertFalse(NotionManifest.load().is_reset)
+        Config.set_writer('hexo')
+        try:
+            manifest = NotionManifest.load()
+            self.assertEqual({}, manifest.pages)
+            self.assertTrue(manifest.is_reset)
+        finally:
+            Config.set_writer('notion')
+
+    def test_output_paths(self):
+        output = mock.Mock(markdown_path='a.md', properties_path='a.md_properties.json',
+                           asset_paths=['assets/logo.png', 'assets/logo_640w.webp'])
+        self.assertEqual(
+            ['a.md', 'a.md_properties.json', 'assets/logo.png', 'assets/logo_640w.webp'],
+            NotionManifest.get_output_paths({'notion': output}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from config import Config
+from notion_page import NotionPage
+from notion_pipeline import PipelineStage
+from notion_reader import NotionReader
+
+
+class PipelineStageTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+
+    def tearDown(self):
+        Config.set_jobs(1)
+
+    def test_bounded_queue(self):
+        handled = []
+        release = threading.Event()
+
+        def handler(item):
+            release.wait()
+            handled.append(item)
+
+        stage = PipelineStage("test", handler, maxsize=2)
+        producer = threading.Thread(target=lambda: [stage.put(it) for it in range(10)])
+        producer.start()
+        time.sleep(0.05)
+        # Blocked by the slow stage: one item in the handler, two in the queue
+        self.assertTrue(producer.is_alive())
+        self.assertLessEqual(stage.queue.qsize(), 2)
+
+        release.set()
+        producer.join()
+        stage.close()
+        self.assertEqual(list(range(10)), handled)
+
+    def test_error(self):
+        def handler(item):
+            if item == 1:
+                raise ValueError('boom')
+
+        stage = PipelineStage("test", handler)
+        stage.put(0)
+        stage.put(1)
+        time.sleep(0.05)
+        self.assertRaises(ValueError, stage.put, 2)
+        self.assertRaises(ValueError, stage.close)
+
+    def test_iter_posts_lazy(self):
+        parsed = []
+
+        def parse_page(page):
+            parsed.append(page['id'])
+            notion_page = NotionPage()
+            notion_page.id = page['id']
+            return notion_page
+
+        Config.set_jobs(2)
+        with mock.patch.object(NotionReader, '_parse_page', side_effect=parse_page):
+            notion_pages = NotionReader.iter_posts([{'id': str(it)} for it in range(100)])
+            self.assertEqual('0', next(notion_pages).id)
+            self.assertEqual('1', next(notion_pages).id)
+            notion_pages.close()
+
+        # Only the look-ahead window was parsed
+        self.assertLessEqual(len(parsed), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
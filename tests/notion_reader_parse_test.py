@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from config import Config
+from notion_page import NotionPage
+from notion_reader import NotionReader
+
+
+class NotionReaderParseTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+
+    def tearDown(self):
+        Config.set_jobs(1)
+
+    def test_parse_pages(self):
+        lock = threading.Lock()
+        state = {'in_flight': 0, 'max_in_flight': 0}
+
+        def parse_page(page):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            # Later pages finish first
+            time.sleep(0.01 * (10 - int(page['id'])))
+            with lock:
+                state['in_flight'] -= 1
+            if page['id'] == '3':
+                raise Exception('boom')
+            notion_page = NotionPage()
+            notion_page.id = page['id']
+            return notion_page
+
+        Config.set_jobs(4)
+        with mock.patch.object(NotionReader, '_parse_page', side_effect=parse_page):
+            notion_pages = NotionReader.parse_pages([{'id': str(it)} for it in range(8)])
+
+        self.assertEqual(['0', '1', '2', '4', '5', '6', '7'], [it.id for it in notion_pages])
+        self.assertLessEqual(state['max_in_flight'], 4)
+        self.assertGreater(state['max_in_flight'], 1)
+
+    def test_refresh_expired_page(self):
+        def page(expiry_time):
+            return {'id': 'page', 'object': 'page', 'properties': {}, 'cover': {
+                'type': 'file', 'file': {'url': 'https://s3.example.com/cover.png', 'expiry_time': expiry_time}}}
+
+        client = mock.Mock()
+        client.pages.retrieve.return_value = page('2999-01-01T00:00:00.000Z')
+        with mock.patch.object(NotionReader, 'get_client', return_value=client), \
+                mock.patch.object(NotionPage, 'parse') as parse:
+            NotionReader._parse_page(page('2999-01-01T00:00:00.000Z'))
+            client.pages.retrieve.assert_not_called()
+            # A stale page from the persisted index is retrieved again for fresh signed urls
+            NotionReader._parse_page(page('2021-05-20T01:00:00.000Z'))
+        client.pages.retrieve.assert_called_once_with(page_id='page')
+        self.assertEqual(client.pages.retrieve.return_value, parse.call_args[0][0])
+
+    def _mock_parse_page(self, parsed, delay=0.0):
+        def parse_page(page):
+            parsed.append(page['id'])
+            time.sleep(delay)
+            if page['id'] == 'broken':
+                raise Exception('boom')
+            notion_page = NotionPage()
+            notion_page.id = page['id']
+            return notion_page
+        return mock.patch.object(NotionReader, '_parse_page', side_effect=parse_page)
+
+    def test_iter_posts_limit(self):
+        parsed = []
+        page_blocks = [{'id': 'broken'}] + [{'id': str(it)} for it in range(100)]
+        Config.set_jobs(4)
+        with self._mock_parse_page(parsed):
+            notion_pages = list(NotionReader.iter_posts(page_blocks, limit=3))
+
+        self.assertEqual(['0', '1', '2'], [it.id for it in notion_pages])
+        # Failed pages do not count, no page parsed beyond the limit
+        self.assertEqual(['broken', '0', '1', '2'], sorted(parsed, key=lambda it: -1 if it == 'broken' else int(it)))
+
+    def test_aiter_posts(self):
+        parsed = []
+        page_blocks = [{'id': str(it)} for it in range(100)]
+
+        async def first_pages(limit):
+            return [it.id async for it in NotionReader.aiter_posts(page_blocks, limit=limit)]
+
+        Config.set_jobs(2)
+        with self._mock_parse_page(parsed):
+            self.assertEqual(['0', '1', '2'], asyncio.run(first_pages(3)))
+        self.assertEqual(3, len(parsed))
+
+    def test_aiter_posts_cancel(self):
+        parsed = []
+        page_blocks = [{'id': str(it)} for it in range(100)]
+        received = []
+
+        async def consume():
+            async for notion_page in NotionReader.aiter_posts(page_blocks):
+                received.append(notion_page.id)
+
+        async def main():
+            task = asyncio.ensure_future(consume())
+            while not received:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        Config.set_jobs(2)
+        with self._mock_parse_page(parsed, delay=0.02):
+            asyncio.run(main())
+            time.sleep(0.1)
+        # Pages not started yet were cancelled
+        self.assertLessEqual(len(parsed), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
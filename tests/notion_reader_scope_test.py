@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import notion_index
+import notion_reader
+from config import Config
+from notion_index import NotionPageIndex
+from notion_reader import NotionReader
+
+
+def _page(page_id, title, parent_id=None):
+    return {
+        'id': page_id,
+        'object': 'page',
+        'parent': {'type': 'page_id', 'page_id': parent_id} if parent_id else {'type': 'workspace', 'workspace': True},
+        'properties': {'title': {'type': 'title', 'title': [{'plain_text': title}]}},
+    }
+
+
+PAGES = [
+    _page('1', 'NotionDown README'),
+    _page('2', 'NotionDown GetTokenV2'),
+    _page('3', 'NotionDown README'),
+]
+
+
+class NotionReaderScopeTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        notion_reader.SCOPED_PAGES = None
+        self.temp_dir = tempfile.TemporaryDirectory()
+        notion_index.PAGE_INDEX = NotionPageIndex(os.path.join(self.temp_dir.name, 'page_index.json'))
+
+    def tearDown(self):
+        notion_reader.SCOPED_PAGES = None
+        notion_index.PAGE_INDEX = None
+        self.temp_dir.cleanup()
+
+    def test_read_pages_with_titles(self):
+        with mock.patch.object(NotionReader, '_read_scoped_pages', return_value=PAGES) as read_scoped_pages:
+            pages = NotionReader.read_pages_with_titles(['NotionDown GetTokenV2', 'NotionDown README', 'Missing'])
+            self.assertEqual(['NotionDown GetTokenV2', 'NotionDown README', 'Missing'], list(pages.keys()))
+            self.assertEqual('2', pages['NotionDown GetTokenV2']['id'])
+            self.assertEqual('1', pages['NotionDown README']['id'])
+            self.assertIsNone(pages['Missing'])
+
+            self.assertEqual('2', NotionReader.read_page_with_title('NotionDown GetTokenV2')['id'])
+            self.assertEqual(1, read_scoped_pages.call_count)
+
+
+    def test_search_pages_with_titles(self):
+        Config.set_blog_url('https://www.notion.so/kaedea/Root-00000000000000000000000000000000')
+        pages = {
+            'NotionDown README': [
+                _page('10000000000000000000000000000000', 'NotionDown README', '20000000000000000000000000000000'),
+                _page('30000000000000000000000000000000', 'NotionDown README', '40000000000000000000000000000000'),
+                _page('50000000000000000000000000000000', 'NotionDown README v2', '00000000000000000000000000000000'),
+            ],
+        }
+        parents = {
+            '20000000000000000000000000000000': _page('20000000000000000000000000000000', 'Parent', '00000000000000000000000000000000'),
+            '40000000000000000000000000000000': _page('40000000000000000000000000000000', 'Other root'),
+        }
+        client = mock.Mock()
+        client.search.side_effect = lambda query, **kwargs: {'results': pages.get(query, []), 'has_more': False}
+        client.pages.retrieve.side_effect = lambda page_id: parents[page_id]
+
+        with mock.patch.object(NotionReader, 'get_client', return_value=client), \
+                mock.patch('notion_index.NotionTransport.get_client', return_value=client), \
+                mock.patch.object(NotionReader, '_read_scoped_pages') as read_scoped_pages:
+            Config.set_page_titles(['NotionDown README', 'Missing'])
+            result = NotionReader._read_post_pages()
+
+        self.assertEqual(['10000000000000000000000000000000'], [it['id'] for it in result])
+        read_scoped_pages.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+import notion_cache
+from config import Config
+from notion_fetcher import NotionBlockFetcher
+from notion_page import NotionPage
+
+
+def _paragraph(block_id, text):
+    return {
+        'id': block_id,
+        'type': 'paragraph',
+        'has_children': False,
+        'paragraph': {'rich_text': [{'type': 'text', 'plain_text': text, 'annotations': {}}]},
+    }
+
+
+def _synced_copy(block_id, source_id):
+    return {
+        'id': block_id,
+        'type': 'synced_block',
+        'has_children': True,
+        'synced_block': {'synced_from': {'type': 'block_id', 'block_id': source_id}},
+    }
+
+
+class NotionSyncedBlockTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        notion_cache.SYNCED_BLOCK_MEMO.clear()
+
+    def tearDown(self):
+        notion_cache.SYNCED_BLOCK_MEMO.clear()
+
+    def test_synced_copies_share_source(self):
+        children = {
+            'copy-1': [_paragraph('p1', 'Footer'), _paragraph('p2', 'Disclaimer')],
+            'copy-2': [_paragraph('p1', 'Footer'), _paragraph('p2', 'Disclaimer')],
+        }
+        with mock.patch.object(NotionBlockFetcher, 'list_children',
+                               side_effect=lambda it, version=None: children[it]) as list_children:
+            pages = []
+            for copy_id in ['copy-1', 'copy-2']:
+                page = NotionPage()
+                page_blocks = []
+                page._parse_synced_block(page_blocks, _synced_copy(copy_id, 'source'))
+                pages.append(page_blocks[0])
+
+        list_children.assert_called_once_with('copy-1')
+        self.assertEqual('source', pages[1].source_id)
+        self.assertEqual(pages[0].write_block(), pages[1].write_block())
+        self.assertIn('Footer\nDisclaimer', pages[1].write_block())
+        # Every copy owns its blocks
+        self.assertIsNot(pages[0].children[0], pages[1].children[0])
+
+        # Later pages do not prefetch the children of memoized sources
+        self.assertEqual([], NotionBlockFetcher._get_fetch_ids(_synced_copy('copy-3', 'source')))
+        self.assertEqual([('copy-4', None)], NotionBlockFetcher._get_fetch_ids(_synced_copy('copy-4', 'other')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from config import Config
+from notion_transport import NotionTransport
+
+
+class NotionTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        Config.set_notion_token("secret_test_token")
+        NotionTransport.close()
+
+    def tearDown(self):
+        NotionTransport.close()
+
+    def test_shared_client(self):
+        client = NotionTransport.get_client()
+        self.assertIs(client, NotionTransport.get_client())
+        self.assertIs(client.client, NotionTransport.get_http_client())
+
+    def test_pool_configs(self):
+        Config.set_http_pool_size(3)
+        Config.set_http_timeout(7)
+        client = NotionTransport.get_client()
+        self.assertEqual(7, client.client.timeout.read)
+        self.assertEqual(3, client.client._transport.transport._pool._max_connections)
+
+
+if __name__ == '__main__':
+    unittest.main()
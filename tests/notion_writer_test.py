@@ -0,0 +1,123 @@
+import copy
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from config import Config
+from notion_page import NotionPage, PageTextBlock, PageChannelBlock, PageImageBlock, \
+    PageColumnListBlock, PageColumnBlock
+from notion_writer import NotionWriter, NotionPageWriter, HexoWriter
+
+
+class NotionWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        Config.parse_configs()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        Config.set_output(self.temp_dir.name)
+
+    def tearDown(self):
+        Config.set('writer', 'notion')
+        Config.set('download_image', False)
+        self.temp_dir.cleanup()
+
+    @staticmethod
+    def _new_page() -> NotionPage:
+        notion_page = NotionPage()
+        notion_page.id = 'page-1'
+        notion_page.properties = {'Title': 'Hello', 'FileName': 'hello', 'Published': 'true'}
+
+        text = PageTextBlock()
+        text.id = 'text-1'
+        text.text = 'Hello world'
+        channel = PageChannelBlock()
+        channel.id = 'channel-1'
+        channel.channel = 'blog'
+        channel_text = PageTextBlock()
+        channel_text.text = 'Blog only'
+        channel.children = [channel_text]
+        image = PageImageBlock()
+        image.id = 'a1b2c3d4-0000-0000-0000-000000000000'
+        image.image_caption = 'Logo'
+        image.image_url = 'https://example.com/logo.png'
+        image.image_version = 'v1'
+        notion_page.blocks = [text, channel, image]
+        return notion_page
+
+    def test_get_writers(self):
+        Config.set_writer('notion | hexo')
+        self.assertEqual(['notion', 'hexo'], NotionWriter.get_writers())
+        Config.set_writer(['notion', 'blog'])
+        self.assertEqual(['notion', 'blog'], NotionWriter.get_writers())
+
+    def test_fan_out(self):
+        Config.set_writer(['notion', 'hexo', 'blog'])
+        Config.set_download_image(True)
+        download_manager = mock.Mock()
+        notion_page = self._new_page()
+
+        with mock.patch.object(
+                NotionPageWriter, '_write_curr_block', autospec=True,
+                side_effect=NotionPageWriter._write_curr_block) as write_curr_block:
+            outputs = NotionWriter.handle_page(notion_page, download_manager)
+
+        self.assertEqual(['notion', 'hexo', 'blog'], list(outputs.keys()))
+        # Blocks are rendered by the first writer writing them only: the text and image once,
+        # the channel block and its child once by 'blog'
+        self.assertEqual(4, write_curr_block.call_count)
+
+        # Each writer links the image into its own assets dir
+        self.assertEqual(3, download_manager.submit_asset.call_count)
+        self.assertEqual(
+            set([os.path.join(self.temp_dir.name, it, 'assets', 'logo_logo_a1b2c3d4.png')
+                 for it in ['NotionDown', 'Hexo', 'blog']]),
+            set([it[0][3] for it in download_manager.submit_asset.call_args_list]))
+
+        for writer, output in outputs.items():
+            self.assertEqual([os.path.join(output.output_dir, 'assets', 'logo_logo_a1b2c3d4.png')], output.asset_paths)
+            with open(output.markdown_path, encoding='utf-8') as f:
+                text = f.read()
+            self.assertIn('Hello world', text)
+            self.assertIn('![Logo](/assets/logo_logo_a1b2c3d4.png)', text)
+            # Channel blocks are filtered per writer
+            self.assertEqual(writer == 'blog', 'Blog only' in text)
+        with open(outputs['hexo'].markdown_path, encoding='utf-8') as f:
+            self.assertIn('title: Hello', f.read())
+
+    def test_render_without_mutation(self):
+        Config.set_download_image(True)
+        notion_page = self._new_page()
+        columns = PageColumnListBlock()
+        for text in ['Left', 'Right']:
+            column = PageColumnBlock()
+            column_text = PageTextBlock()
+            column_text.text = text
+            column.children = [column_text, copy.deepcopy(notion_page.blocks[2])]
+            columns.children.append(column)
+        notion_page.blocks.append(columns)
+        snapshot = copy.deepcopy(notion_page.blocks)
+
+        def render(writer):
+            writer.image_downloader.download_manager = mock.Mock()
+            return writer._start_writing(notion_page)[:-1]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(render, [NotionPageWriter() if it % 2 else HexoWriter() for it in range(8)]))
+
+        for idx, page_lines in enumerate(results):
+            self.assertEqual(results[idx % 2], page_lines)
+        text = "\n".join(results[1])
+        self.assertIn('<!-- Column 1 start -->\nRight\n\n![Logo](/assets/logo_logo_a1b2c3d4.png)', text)
+        for block, block_snapshot in zip(notion_page.blocks, snapshot):
+            self.assertEqual(self._dump(block_snapshot), self._dump(block))
+
+    def _dump(self, block):
+        values = {k: v for k, v in vars(block).items() if k not in ['children', 'block_joiner']}
+        values['children'] = [self._dump(it) for it in block.children or []]
+        return values
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import time
+import unittest
+from unittest import mock
+
+import httpx
+
+from notion_transport import RateLimitedTransport
+from utils.rate_limiter import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_sustained_rate(self):
+        bucket = TokenBucket(20, capacity=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0)
+        start = time.monotonic()
+        for _ in range(1000):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class RateLimitedTransportTest(unittest.TestCase):
+
+    def _create_client(self, responses, max_retries=3, max_retry_after=60.0):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return responses[min(len(calls), len(responses)) - 1]
+
+        transport = RateLimitedTransport(httpx.MockTransport(handler), TokenBucket(0), max_retries, max_retry_after)
+        return httpx.Client(transport=transport), calls
+
+    @mock.patch('notion_transport.time.sleep')
+    def test_retry_after(self, sleep):
+        client, calls = self._create_client([
+            httpx.Response(429, headers={'Retry-After': '2'}),
+            httpx.Response(200, json={'ok': True}),
+        ])
+        response = client.post('https://api.notion.com/v1/search', json={})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(calls))
+        sleep.assert_called_once_with(2.0)
+
+    @mock.patch('notion_transport.time.sleep')
+    def test_retry_after_clamped(self, sleep):
+        client, calls = self._create_client([
+            httpx.Response(429, headers={'Retry-After': '86400'}),
+            httpx.Response(200),
+        ], max_retry_after=30.0)
+        bucket = client._transport.bucket
+        with mock.patch.object(bucket, 'pause', wraps=bucket.pause) as pause:
+            self.assertEqual(200, client.get('https://api.notion.com/v1/users').status_code)
+        pause.assert_called_once_with(30.0)
+        sleep.assert_called_once_with(30.0)
+
+    @mock.patch('notion_transport.time.sleep')
+    def test_retry_server_error_with_backoff(self, sleep):
+        client, calls = self._create_client([
+            httpx.Response(502),
+            httpx.Response(503),
+            httpx.Response(200),
+        ])
+        self.assertEqual(200, client.get('https://api.notion.com/v1/users').status_code)
+        self.assertEqual(3, len(calls))
+        self.assertEqual(2, sleep.call_count)
+
+    @mock.patch('notion_transport.time.sleep')
+    def test_give_up_after_max_retries(self, sleep):
+        client, calls = self._create_client([httpx.Response(429)], max_retries=2)
+        self.assertEqual(429, client.get('https://api.notion.com/v1/users').status_code)
+        self.assertEqual(3, len(calls))
+
+    @mock.patch('notion_transport.time.sleep')
+    def test_no_retry_on_client_error(self, sleep):
+        client, calls = self._create_client([httpx.Response(404)])
+        self.assertEqual(404, client.get('https://api.notion.com/v1/users').status_code)
+        self.assertEqual(1, len(calls))
+        sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
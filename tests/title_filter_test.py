@@ -0,0 +1,39 @@
+import unittest
+
+from utils.title_filter import TitleFilter
+from utils.utils import Utils
+
+
+class TitleFilterTest(unittest.TestCase):
+
+    def test_match(self):
+        title_filter = TitleFilter(["^(Hexo page -)", "NotionDown", "Notion"])
+        self.assertEqual("^(Hexo page -)", title_filter.match("Hexo page - Hello"))
+        self.assertEqual("NotionDown", title_filter.match("NotionDown README"))
+        # re.match semantics, anchored at the start
+        self.assertIsNone(title_filter.match("About NotionDown"))
+        self.assertIsNone(TitleFilter([]).match("NotionDown"))
+
+    def test_filter(self):
+        pages = [
+            {'id': '1', 'title': 'NotionDown README'},
+            {'id': '2', 'title': 'Hexo page - Hello'},
+            {'id': '3', 'title': 'Other'},
+            {'id': '1', 'title': 'NotionDown README'},
+        ]
+        matches = TitleFilter(["Hexo", "Notion"]).filter(pages, lambda it: it['title'], lambda it: it['id'])
+        self.assertEqual([('1', 'Notion'), ('2', 'Hexo')], [(it['id'], pattern) for it, pattern in matches])
+
+    def test_find_one(self):
+        calls = []
+
+        def predicate(it):
+            calls.append(it)
+            return it > 1
+        self.assertEqual(2, Utils.find_one([1, 2, 3], predicate))
+        self.assertEqual([1, 2], calls)
+        self.assertEqual([], Utils.find_one([1], predicate))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,26 @@
 """Utilities for database column ordering configuration."""
 
 import re
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+# Supported 'row-filter' operators, longer ones first so that '>=' is not read as '>'
+ROW_FILTER_PATTERN = re.compile(r'^\s*(.+?)\s*(!=|>=|<=|=|>|<|\bnot contains\b|\bcontains\b)\s*(.*?)\s*$', re.IGNORECASE)
+# One 'row-filter' condition: commas inside quotes or escaped as '\,' do not end it
+ROW_FILTER_ITEM_PATTERN = re.compile(r'(?:"[^"]*"|\'[^\']*\'|\\.|[^,])+')
+
+TEXT_PROPERTY_TYPES = ['title', 'rich_text', 'url', 'email', 'phone_number']
+
+# property type -> row-filter operator -> Notion filter condition
+ROW_FILTER_CONDITIONS = {
+    'text': {'=': 'equals', '!=': 'does_not_equal', 'contains': 'contains', 'not contains': 'does_not_contain'},
+    'select': {'=': 'equals', '!=': 'does_not_equal'},
+    'status': {'=': 'equals', '!=': 'does_not_equal'},
+    'multi_select': {'=': 'contains', 'contains': 'contains', '!=': 'does_not_contain', 'not contains': 'does_not_contain'},
+    'number': {'=': 'equals', '!=': 'does_not_equal', '>': 'greater_than', '<': 'less_than',
+               '>=': 'greater_than_or_equal_to', '<=': 'less_than_or_equal_to'},
+    'checkbox': {'=': 'equals', '!=': 'does_not_equal'},
+    'date': {'=': 'equals', '>': 'after', '<': 'before', '>=': 'on_or_after', '<=': 'on_or_before'},
+}
 
 
 class DatabaseColumnOrderingUtils:
@@ -97,6 +116,142 @@ class DatabaseColumnOrderingUtils:
                 
         return sorts if sorts else None
 
+    @staticmethod
+    def parse_row_limit(description_text: str) -> Optional[int]:
+        """
+        Parses row-limit configuration from description text.
+        Format: row-limit: 500
+        Returns the maximum number of rows to export, or None if not configured.
+        """
+        if not description_text:
+            return None
+
+        match = re.search(r'(?:^|\n)\s*row-limit:\s*(\d+)\s*(?:\n|$)', description_text, re.IGNORECASE | re.MULTILINE)
+        if not match:
+            return None
+        row_limit = int(match.group(1))
+        return row_limit if row_limit > 0 else None
+
+    @staticmethod
+    def parse_row_filter(description_text: str) -> Optional[List[Dict[str, str]]]:
+        """
+        Parses row-filter configuration from description text.
+        Format: row-filter: Status = Done, Score >= 3, Tags contains Python
+        Conditions are combined with AND, supported operators are
+        =, !=, >, <, >=, <=, contains and not contains. Values holding a comma
+        are quoted or escaped: Tags contains "a, b", Title = Hello\\, world
+
+        Returns:
+            list of {"property", "operator", "value"} or None if not configured
+        """
+        if not description_text:
+            return None
+
+        match = re.search(r'(?:^|\n)\s*row-filter:\s*(.+?)(?:\n|$)', description_text, re.IGNORECASE | re.MULTILINE)
+        if not match:
+            return None
+
+        conditions = []
+        for item in ROW_FILTER_ITEM_PATTERN.findall(match.group(1)):
+            condition = ROW_FILTER_PATTERN.match(item)
+            if not condition:
+                continue
+            value = condition.group(3).strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in ['"', "'"]:
+                value = value[1:-1]
+            else:
+                value = value.replace('\\,', ',')
+            conditions.append({
+                "property": condition.group(1).strip(),
+                "operator": condition.group(2).lower(),
+                "value": value,
+            })
+        return conditions if conditions else None
+
+    @staticmethod
+    def build_query_filter(conditions: Optional[List[Dict[str, str]]],
+                           properties: Dict) -> Tuple[Optional[Dict], List[Dict[str, str]]]:
+        """Translate row-filter conditions into a Notion query filter.
+
+        Conditions on properties missing from the schema, or with operators the
+        property type does not support, cannot be pushed down to the server.
+
+        Args:
+            conditions: Parsed row-filter conditions
+            properties: Database properties schema from Notion API
+
+        Returns:
+            (Notion query filter or None, conditions left to be applied locally)
+        """
+        filters = []
+        local_conditions = []
+        for condition in conditions or []:
+            query_filter = DatabaseColumnOrderingUtils._build_property_filter(
+                condition, (properties or {}).get(condition['property'], {}).get('type'))
+            if query_filter:
+                filters.append(query_filter)
+            else:
+                local_conditions.append(condition)
+
+        if not filters:
+            return None, local_conditions
+        if len(filters) == 1:
+            return filters[0], local_conditions
+        return {"and": filters}, local_conditions
+
+    @staticmethod
+    def _build_property_filter(condition: Dict[str, str], prop_type: Optional[str]) -> Optional[Dict]:
+        conditions = ROW_FILTER_CONDITIONS.get('text' if prop_type in TEXT_PROPERTY_TYPES else prop_type)
+        if not conditions or condition['operator'] not in conditions:
+            return None
+
+        value: Any = condition['value']
+        if prop_type == 'number':
+            try:
+                value = float(value) if '.' in value else int(value)
+            except ValueError:
+                return None
+        elif prop_type == 'checkbox':
+            value = value.lower() in ['true', 'yes', '1']
+
+        return {
+            "property": condition['property'],
+            prop_type: {conditions[condition['operator']]: value}
+        }
+
+    @staticmethod
+    def match_row_filter(conditions: Optional[List[Dict[str, str]]], values: Dict[str, str]) -> bool:
+        """
+        Apply row-filter conditions locally, on the rendered property values of a row.
+        """
+        for condition in conditions or []:
+            expected = DatabaseColumnOrderingUtils._normalize_filter_value(condition['value'])
+            actual = DatabaseColumnOrderingUtils._normalize_filter_value(values.get(condition['property'], ''))
+            operator = condition['operator']
+            if operator == 'contains' or operator == 'not contains':
+                if (expected in actual) != (operator == 'contains'):
+                    return False
+                continue
+            try:
+                actual, expected = float(actual), float(expected)
+            except ValueError:
+                pass
+            if not {
+                '=': actual == expected,
+                '!=': actual != expected,
+                '>': actual > expected,
+                '<': actual < expected,
+                '>=': actual >= expected,
+                '<=': actual <= expected,
+            }[operator]:
+                return False
+        return True
+
+    @staticmethod
+    def _normalize_filter_value(value: str) -> str:
+        value = str(value).strip().lower()
+        return {'true': 'yes', 'false': 'no'}.get(value, value)
+
     @staticmethod
     def sort_columns_by_weight(headers: List[str], weights: Optional[Dict[str, int]]) -> List[str]:
         """
@@ -136,6 +291,35 @@ class DatabaseColumnOrderingUtils:
         sorted_headers = sorted(visible_headers, key=get_weight, reverse=True)
         return sorted_headers
 
+    @staticmethod
+    def sort_rows(rows: List[Dict], sorts: List[Dict]) -> List[Dict]:
+        """Sort queried rows locally, like the Notion API would with the given property sorts.
+
+        Rows keep their queried order for equal values, empty values go last.
+
+        Args:
+            rows: Database rows (pages) from a Notion query
+            sorts: Property sorts as returned by get_database_sorts
+
+        Returns:
+            Sorted list of rows
+        """
+        rows = list(rows)
+        for sort in reversed(sorts):
+            prop_name = sort.get('property')
+            if not prop_name:
+                continue
+
+            def get_value(row):
+                prop = row.get('properties', {}).get(prop_name, {})
+                return prop.get(prop.get('type'))
+
+            present = [it for it in rows if get_value(it) is not None]
+            empty = [it for it in rows if get_value(it) is None]
+            present.sort(key=get_value, reverse=sort.get('direction') == 'descending')
+            rows = present + empty
+        return rows
+
     @staticmethod
     def get_database_sorts(properties: Dict) -> List[Dict]:
         """Determine database row sorting configuration.
@@ -0,0 +1,73 @@
+"""Resize and recompress images into responsive variants, with Pillow if installed."""
+
+import os
+import tempfile
+import typing
+
+from utils.utils import Utils
+
+# Pillow save() options per output format
+IMAGE_FORMATS = {
+    'webp': {'format': 'WEBP', 'method': 6},
+    'jpeg': {'format': 'JPEG', 'optimize': True, 'progressive': True},
+}
+# Formats kept as they are, e.g. animated images and vectors
+SKIP_EXTENSIONS = ['.gif', '.svg', '.ico']
+
+
+class ImageUtils:
+
+    @staticmethod
+    def is_supported() -> bool:
+        return Utils.check_module_installed("Pillow")
+
+    @staticmethod
+    def can_optimize(file_path: str) -> bool:
+        return os.path.splitext(file_path)[1].lower() not in SKIP_EXTENSIONS
+
+    @staticmethod
+    def get_variant_ext(image_format: str) -> str:
+        return '.jpg' if image_format == 'jpeg' else '.' + image_format
+
+    @staticmethod
+    def encode_variants(
+            src_path: str,
+            variants: typing.List[typing.Tuple[int, str]],
+            image_format: str = 'webp',
+            quality: int = 80) -> typing.List[str]:
+        """
+        Encode the image into one file per (max width, path), never upscaled.
+        Runs in worker processes, so only takes and returns plain values.
+
+        :return: the paths encoded, the others are left for the caller to fall back.
+        """
+        from PIL import Image, ImageOps
+
+        options = dict(IMAGE_FORMATS.get(image_format, IMAGE_FORMATS['webp']))
+        encoded = []
+        with Image.open(src_path) as image:
+            if getattr(image, 'is_animated', False):
+                return encoded
+            image = ImageOps.exif_transpose(image)
+            if options['format'] == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            elif image.mode not in ['RGB', 'RGBA']:
+                image = image.convert('RGBA')
+
+            for width, variant_path in variants:
+                resized = image
+                if image.width > width:
+                    height = max(1, round(image.height * width / image.width))
+                    resized = image.resize((width, height), Image.LANCZOS)
+                variant_dir = os.path.dirname(variant_path) or '.'
+                os.makedirs(variant_dir, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(prefix=".variant-", suffix=".part", dir=variant_dir)
+                os.close(fd)
+                try:
+                    resized.save(temp_path, quality=int(quality), **options)
+                    os.replace(temp_path, variant_path)
+                    encoded.append(variant_path)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+        return encoded
@@ -0,0 +1,46 @@
+"""Thread-safe token bucket for throttling API requests."""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket limiting the sustained rate of requests across threads.
+
+    Tokens are refilled at `rate` per second, up to `capacity` tokens, and every
+    request takes one token. A `rate` <= 0 disables throttling.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.resume_at:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.resume_at - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold back every caller for `seconds`, e.g. when the server asks to retry later."""
+        with self.lock:
+            now = time.monotonic()
+            self.resume_at = max(self.resume_at, now + seconds)
+            self.tokens = 0
+            self.updated_at = max(self.updated_at, self.resume_at)
@@ -0,0 +1,37 @@
+"""Precompiled matcher for the 'page_titles_match' patterns."""
+
+import re
+import typing
+
+
+class TitleFilter:
+    """Match page titles against a list of regex patterns, compiled once.
+
+    Patterns follow `re.match` semantics (anchored at the start of the title) and
+    are tried in the given order, the first matching pattern wins.
+    """
+
+    def __init__(self, patterns: typing.List[str]):
+        self.patterns = [(it, re.compile(it)) for it in patterns or []]
+
+    def match(self, title: str) -> typing.Optional[str]:
+        """Return the first pattern matching the title, or None."""
+        for pattern, regex in self.patterns:
+            if regex.match(title):
+                return pattern
+        return None
+
+    def filter(self, items: typing.Iterable, get_title: typing.Callable[[typing.Any], str],
+               get_id: typing.Callable[[typing.Any], str] = None) -> typing.List[typing.Tuple[typing.Any, str]]:
+        """Return (item, matched pattern) of the matching items, deduplicated by id, in input order."""
+        matches = []
+        seen_ids = set()
+        for item in items:
+            item_id = get_id(item) if get_id else id(item)
+            if item_id in seen_ids:
+                continue
+            pattern = self.match(get_title(item))
+            if pattern is not None:
+                seen_ids.add(item_id)
+                matches.append((item, pattern))
+        return matches
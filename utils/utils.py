@@ -43,10 +43,10 @@ class Utils:
 
     @staticmethod
     def find_one(array, predicate):
-        finds = [it for it in array if predicate(it)]
-        if finds:
-            return finds[0]
-        return finds
+        for it in array:
+            if predicate(it):
+                return it
+        return []
 
     @staticmethod
     def parse_json(file_path):